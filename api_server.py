@@ -0,0 +1,394 @@
+import json
+import asyncio
+import threading
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
+from progress_bus import job_fields
+from download_scheduler import DownloadJob
+from download_engine import QUALITIES
+from queue_runner import QueueRunner
+
+MAX_BODY = 1024 * 1024
+MAX_TRACKED = 1000  # Finished items remembered for polling after they left the queue
+MAX_BACKLOG = 1000  # Events queued for one stream before it is dropped as too slow
+KEEPALIVE = 15.0  # seconds between SSE comments on an idle stream
+FINAL_OUTCOMES = (QueueRunner.ITEM_DONE, QueueRunner.ITEM_FAILED)
+OPTION_KEYS = ('quality', 'playlist', 'tags', 'normalize')
+FLAG_KEYS = ('playlist', 'tags', 'normalize')
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiServer:
+    """Local HTTP API for other programs to submit URLs and follow them.
+
+    Submitted URLs go into the same UrlQueue as the GUI's Download button and
+    are run by ``runner``, a QueueRunner; ``options()`` returns the download
+    options they start from. The host passes job changes to ``job_changed``
+    and finished items to ``item_finished`` (the runner's on_update and
+    on_item). Runs an asyncio loop on its own thread, bound to localhost.
+
+    - ``POST /jobs`` ``{"url": ...}`` or ``{"urls": [...]}``, optionally with
+      quality, playlist, tags, normalize and priority: queues the URLs
+    - ``GET /jobs``, ``GET /jobs/<id>``: queue items with their progress
+    - ``GET /events``, ``GET /jobs/<id>/events``: progress as server-sent events
+    - ``POST /jobs/<id>/pause|resume|retry``, ``DELETE /jobs/<id>``
+    - ``GET /history?search=&channel=&limit=&before=&before_id=``: converted files,
+      the next page starts before the downloaded_at and id of the last row
+    """
+
+    def __init__(self, queue, runner, options, archive=None, port=0, host='127.0.0.1'):
+        self.queue = queue
+        self.runner = runner
+        self.options = options
+        self.archive = archive
+        self.port = port
+        self.host = host
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # item id -> {'jobs': {job id: fields}, 'outcome': ...}
+        self._last = {}  # (item id, job id) -> last published key
+        self._streams = set()  # (item id or None for all, asyncio.Queue)
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        # Returns once the port is bound, so an error such as a taken port is raised here
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self.handle, self.host, self.port))
+                self.port = self._server.sockets[0].getsockname()[1]
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                self._loop.close()
+                return
+            ready.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._server.close()
+                self._loop.run_until_complete(self._server.wait_closed())
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='api', daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+
+    # Called from worker threads
+
+    def job_changed(self, job):
+        item_id = (job.options or {}).get('queue_item')
+        if item_id is None:
+            return
+        # Like the CLI's progress lines: only when the state, status or whole percent moved
+        key = (job.state, int(job.progress), job.status_text)
+        fields = dict(job_fields(job), id=job.id, url=job.url)
+        with self._lock:
+            known = item_id in self._items
+        # The item leaves the queue when it is done, keep what it was for later polls
+        item = None if known else self.queue.get(item_id)
+        with self._lock:
+            entry = self.track(item_id)
+            if item is not None:
+                entry['url'], entry['title'] = item['url'], item['title']
+            if entry['outcome'] is not None:
+                # Started again after a retry or cancel, the old jobs are history
+                entry['jobs'].clear()
+                entry['outcome'] = None
+            entry['jobs'][job.id] = fields
+            if self._last.get((item_id, job.id)) == key:
+                return
+            self._last[(item_id, job.id)] = key
+        self.publish('job', item_id, dict(fields, item=item_id))
+
+    def item_finished(self, item_id, outcome, jobs):
+        files = [job.result for job in jobs if job.result and job.state in (DownloadJob.DONE, DownloadJob.SKIPPED)]
+        errors = [job.error for job in jobs if job.error]
+        with self._lock:
+            entry = self.track(item_id)
+            entry['outcome'] = outcome
+            entry['files'] = files
+            entry['error'] = errors[0] if errors else None
+            for job in jobs:
+                self._last.pop((item_id, job.id), None)
+        self.publish('item', item_id, {'id': item_id, 'state': outcome, 'files': files,
+                                       'error': errors[0] if errors else None})
+
+    def track(self, item_id):
+        entry = self._items.get(item_id)
+        if entry is None:
+            entry = self._items[item_id] = {'jobs': {}, 'outcome': None, 'files': [], 'error': None,
+                                            'url': None, 'title': None}
+            while len(self._items) > MAX_TRACKED:
+                self._items.popitem(last=False)
+        return entry
+
+    def publish(self, event, item_id, data):
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self.broadcast, event, item_id, data)
+
+    # On the event loop
+
+    def broadcast(self, event, item_id, data):
+        for stream in list(self._streams):
+            wanted, events = stream
+            if wanted is not None and wanted != item_id:
+                continue
+            if events.qsize() >= MAX_BACKLOG:
+                self._streams.discard(stream)
+                events.put_nowait(None)  # Ends the stream, the client can reconnect and poll
+                continue
+            events.put_nowait((event, data))
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, query, headers, body = await self.read_request(reader)
+            if not self.local_host(headers):
+                raise ApiError(HTTPStatus.FORBIDDEN, "Host must be 127.0.0.1 or localhost")
+            if method != 'GET' and not self.local_origin(headers):
+                raise ApiError(HTTPStatus.FORBIDDEN, "Requests from web pages are not allowed")
+            parts = [part for part in path.split('/') if part]
+            if method == 'GET' and parts == ['events']:
+                await self.stream(writer, None)
+            elif method == 'GET' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+                await self.stream(writer, self.item_id(parts[1]))
+            else:
+                status, result = await self.route(method, parts, query, body)
+                self.respond(writer, status, result)
+        except ApiError as e:
+            self.respond(writer, e.status, {'error': str(e)})
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed request"})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            self.respond(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def read_request(self, reader):
+        # One request per connection, enough for local tools and curl
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        target = urlsplit(target)
+        return method.upper(), target.path, parse_qs(target.query), headers, body
+
+    def local_host(self, headers):
+        # A web page that points its own name at 127.0.0.1 (DNS rebinding) still sends that name
+        host = (headers.get('host') or '').lower()
+        return host in (f'127.0.0.1:{self.port}', f'localhost:{self.port}')
+
+    def local_origin(self, headers):
+        # Browsers send Origin with cross-site POSTs, a page on the web must not queue downloads
+        origin = headers.get('origin')
+        if not origin:
+            return True
+        return urlsplit(origin).hostname in LOCAL_HOSTS
+
+    def respond(self, writer, status, result=None):
+        status = HTTPStatus(status)
+        body = b'' if result is None else json.dumps(result, ensure_ascii=False).encode('utf-8')
+        lines = [f'HTTP/1.1 {status.value} {status.phrase}', 'Connection: close',
+                 f'Content-Length: {len(body)}']
+        if result is not None:
+            lines.append('Content-Type: application/json; charset=utf-8')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    def item_id(self, text):
+        try:
+            return int(text)
+        except ValueError:
+            raise ApiError(HTTPStatus.NOT_FOUND, "No such job")
+
+    async def route(self, method, parts, query, body):
+        # Database work runs on the default executor, the loop only moves bytes
+        run = lambda function, *args: asyncio.get_running_loop().run_in_executor(None, function, *args)
+        if parts == ['health'] and method == 'GET':
+            return HTTPStatus.OK, {'status': 'ok'}
+        if parts == ['jobs'] and method == 'GET':
+            return HTTPStatus.OK, {'jobs': await run(self.list_jobs)}
+        if parts == ['jobs'] and method == 'POST':
+            return HTTPStatus.ACCEPTED, {'jobs': await run(self.submit, body)}
+        if parts == ['history'] and method == 'GET':
+            return HTTPStatus.OK, {'history': await run(self.history, query)}
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            item_id = self.item_id(parts[1])
+            action = parts[2] if len(parts) == 3 else None
+            if len(parts) == 2 and method == 'GET':
+                view = await run(self.job_view, item_id)
+                if view is None:
+                    raise ApiError(HTTPStatus.NOT_FOUND, "No such job")
+                return HTTPStatus.OK, view
+            if len(parts) == 2 and method == 'DELETE':
+                await run(self.remove, item_id)
+                return HTTPStatus.NO_CONTENT, None
+            if action in ('pause', 'resume', 'retry') and method == 'POST':
+                return HTTPStatus.OK, await run(self.control, item_id, action)
+        raise ApiError(HTTPStatus.NOT_FOUND, "Not found")
+
+    async def stream(self, writer, item_id):
+        events = asyncio.Queue()
+        stream = (item_id, events)
+        # Subscribed before the snapshot is taken, so no change falls in between
+        self._streams.add(stream)
+        try:
+            view = None
+            if item_id is not None:
+                view = await asyncio.get_running_loop().run_in_executor(None, self.job_view, item_id)
+                if view is None:
+                    raise ApiError(HTTPStatus.NOT_FOUND, "No such job")
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+            if view is not None:
+                self.send_event(writer, 'snapshot', view)
+                if view['state'] in FINAL_OUTCOMES:
+                    return
+            await self.send_events(writer, item_id, events)
+        finally:
+            self._streams.discard(stream)
+
+    async def send_events(self, writer, item_id, events):
+        while True:
+            await writer.drain()
+            try:
+                message = await asyncio.wait_for(events.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                writer.write(b': keepalive\n\n')
+                continue
+            if message is None:
+                return
+            event, data = message
+            self.send_event(writer, event, data)
+            # A single item's stream ends with its final state
+            if item_id is not None and event == 'item' and data['state'] in FINAL_OUTCOMES:
+                return
+
+    def send_event(self, writer, event, data):
+        writer.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    # On executor threads
+
+    def submit(self, body):
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+        if not isinstance(request, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+        urls = request.get('urls') or ([request['url']] if request.get('url') else [])
+        if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url.strip()
+                                                              for url in urls):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Give a 'url' or a list of 'urls'")
+        for key in FLAG_KEYS:
+            if key in request and not isinstance(request[key], bool):
+                raise ApiError(HTTPStatus.BAD_REQUEST, f"{key} must be true or false")
+        options = self.options()
+        for key in OPTION_KEYS:
+            if key in request:
+                options[key] = request[key]
+        options['quality'] = str(options['quality'])
+        if options['quality'] not in QUALITIES:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"quality must be one of {', '.join(QUALITIES)}")
+        try:
+            priority = int(request.get('priority') or 0)
+        except (TypeError, ValueError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "priority must be a number")
+        items = [{'id': self.queue.add(url.strip(), options, priority), 'url': url.strip()}
+                 for url in urls]
+        self.runner.wake()
+        return items
+
+    def job_view(self, item_id):
+        item = self.queue.get(item_id)
+        with self._lock:
+            entry = dict(self._items.get(item_id) or {'jobs': {}, 'outcome': None, 'files': [],
+                                                       'error': None, 'url': None, 'title': None})
+        jobs = list(entry['jobs'].values())
+        if item is None and entry['outcome'] is None:
+            return None
+        if item is not None:
+            state = 'running' if item['state'] == self.queue.ACTIVE else item['state']
+            view = {'id': item_id, 'url': item['url'], 'title': item['title'], 'state': state,
+                    'attempts': item['attempts'], 'error': item['error'] or entry['error'],
+                    'next_attempt_at': item['next_attempt_at'] or None}
+        else:
+            # Done, it has left the queue
+            view = {'id': item_id, 'url': entry['url'],
+                    'title': entry['title'] or (jobs[0]['title'] if len(jobs) == 1 else None),
+                    'state': entry['outcome'], 'error': entry['error']}
+        view['progress'] = round(sum(job['progress'] for job in jobs) / len(jobs), 1) if jobs else 0.0
+        view['files'] = entry['files']
+        view['jobs'] = jobs
+        return view
+
+    def list_jobs(self):
+        views = [self.job_view(item['id']) for item in self.queue.items()]
+        with self._lock:
+            done = [item_id for item_id, entry in self._items.items()
+                    if entry['outcome'] == QueueRunner.ITEM_DONE]
+        return [view for view in views if view] + [self.job_view(item_id) for item_id in done]
+
+    def history(self, query):
+        if self.archive is None:
+            return []
+        value = lambda name: query.get(name, [None])[0]
+        try:
+            limit = max(1, min(int(value('limit') or 100), 500))
+            offset = max(0, int(value('offset') or 0))
+            before = (value('before'), int(value('before_id'))) if value('before') else None
+        except (ValueError, TypeError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "limit, offset and before_id must be numbers")
+        return self.archive.recent(limit, offset, value('search'), value('channel'), value('since'), before)
+
+    def remove(self, item_id):
+        if self.queue.get(item_id) is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, "No such job")
+        self.runner.remove_item(item_id)
+
+    def control(self, item_id, action):
+        if self.queue.get(item_id) is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, "No such job")
+        if action == 'pause':
+            self.runner.pause_item(item_id)
+        elif action == 'resume':
+            self.queue.resume(item_id)
+        else:
+            self.queue.retry(item_id)
+        self.runner.wake()
+        return self.job_view(item_id)
@@ -0,0 +1,224 @@
+"""End-to-end throughput and latency of the download path.
+
+Runs DownloadEngine (the code behind the GUI's download thread and the CLI)
+against FakeMediaServer, so it works offline and results are comparable
+between runs. Needs ffmpeg on PATH or --ffmpeg. Measures:
+
+- single: time from submitting one video to the MP3 being written, the
+  first (cold) run separately since it pays for loading yt-dlp's extractors
+- playlist: videos/s and MB/s for a playlist at each concurrency level
+- transcode: ffmpeg time per quality in QUALITIES for one file
+- postprocess: per-file time of plain encoding, with ID3 tags and cover
+  art, and with two-pass loudness normalization (analysis and encode)
+- memory: peak Python allocations and peak RSS of the process
+
+    python benchmarks/bench_engine.py --seconds 20 --playlist-size 8 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from download_scheduler import DownloadJob
+from download_engine import DownloadEngine, QUALITIES, default_options
+from transcoder import TranscodePool, find_ffmpeg, transcode_to_mp3, run_ffmpeg
+from fake_server import FakeMediaServer, fake_extractors
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    usage = {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    return {name: round(value / scale, 1) for name, value in usage.items()}
+
+
+def run_batch(engine, urls, options):
+    # Returns elapsed seconds, seconds until the first byte arrived, and the finished jobs
+    output_dir = tempfile.mkdtemp(prefix='bench_engine_')
+    options = dict(options, output_dir=output_dir)
+    first_progress = []
+
+    def on_update(job):
+        if not first_progress and job.downloaded_bytes:
+            first_progress.append(time.perf_counter())
+
+    try:
+        started = time.perf_counter()
+        scheduler = engine.run(urls, options, on_update=on_update)
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    jobs = scheduler.snapshot()
+    failed = [job.error for job in jobs if job.state != DownloadJob.DONE]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(jobs)} jobs did not finish: {failed[0]}")
+    return elapsed, (first_progress[0] - started) if first_progress else None, jobs
+
+
+def bench_single(engine, options, runs):
+    elapsed, first_byte = [], []
+    for n in range(runs + 1):
+        seconds, first, _ = run_batch(engine, [f'benchvideo:single{n:03d}'], options)
+        elapsed.append(round(seconds, 4))
+        first_byte.append(round(first, 4) if first is not None else None)
+    cold, warm = elapsed[0], elapsed[1:]
+    return {'cold_s': cold, 'runs_s': warm, 'median_s': median(warm),
+            'first_byte_median_s': median([value for value in first_byte[1:] if value is not None])}
+
+
+def bench_playlist(engine, options, size, concurrency_levels, source_bytes):
+    results = []
+    for concurrency in concurrency_levels:
+        seconds, _, jobs = run_batch(engine, [f'benchplaylist:{size}'],
+                                     dict(options, playlist=True, concurrency=concurrency))
+        results.append({
+            'concurrency': concurrency,
+            'videos': len(jobs),
+            'elapsed_s': round(seconds, 4),
+            'videos_per_s': round(len(jobs) / seconds, 3),
+            'mb_per_s': round(len(jobs) * source_bytes / seconds / 1e6, 3),
+        })
+    return results
+
+
+def bench_transcode(body, ffmpeg, runs):
+    # ffmpeg alone, without the download in front of it
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='bench_transcode_')
+    try:
+        source = os.path.join(work_dir, 'source.wav')
+        with open(source, 'wb') as f:
+            f.write(body)
+        for quality in QUALITIES:
+            times = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                target = transcode_to_mp3(source, quality, ffmpeg, keep_source=True)
+                times.append(round(time.perf_counter() - started, 4))
+            results[quality] = {'runs_s': times, 'median_s': median(times),
+                                'output_bytes': os.path.getsize(target)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def bench_postprocess(body, ffmpeg, runs, quality='192'):
+    # What tagging and normalization add to encoding one file
+    tags = {'title': 'Benchmark', 'artist': 'bench_engine', 'date': '2024'}
+    variants = {'plain': {}, 'tags_cover': {'tags': tags, 'cover': True},
+                'normalize': {'tags': tags, 'cover': True, 'normalize': True}}
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='bench_postprocess_')
+    try:
+        source = os.path.join(work_dir, 'source.wav')
+        with open(source, 'wb') as f:
+            f.write(body)
+        image = os.path.join(work_dir, 'image.jpg')
+        run_ffmpeg(['-f', 'lavfi', '-i', 'color=c=red:s=1280x720', '-frames:v', '1', image], ffmpeg)
+        for name, variant in variants.items():
+            runs_s, stages = [], {}
+            for _ in range(runs):
+                cover = None
+                if variant.get('cover'):
+                    # The converter removes the cover file once it is embedded
+                    cover = os.path.join(work_dir, 'source.cover')
+                    shutil.copy(image, cover)
+                timings = {}
+                transcode_to_mp3(source, quality, ffmpeg, keep_source=True, timings=timings,
+                                 tags=variant.get('tags'), cover=cover,
+                                 normalize=variant.get('normalize', False))
+                runs_s.append(round(sum(timings.values()), 4))
+                for stage, seconds in timings.items():
+                    stages.setdefault(stage, []).append(seconds)
+            results[name] = {'runs_s': runs_s, 'median_s': median(runs_s),
+                             'stages_median_s': {stage: round(median(values), 4)
+                                                 for stage, values in stages.items()}}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=20, help="length of the synthetic audio")
+    parser.add_argument('--playlist-size', type=int, default=8)
+    parser.add_argument('--concurrency', default='1,2,4,8', help="comma separated levels to try")
+    parser.add_argument('--runs', type=int, default=3, help="repetitions for single and transcode")
+    parser.add_argument('--latency', type=float, default=0.0, help="server response delay in seconds")
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help="per-connection limit in bytes/s (default: unlimited)")
+    parser.add_argument('--segments', type=int, default=1, help="range requests per file")
+    parser.add_argument('--ffmpeg', default=None, help="ffmpeg binary (default: the one the app uses)")
+    parser.add_argument('--output', help="also write the JSON results here")
+    args = parser.parse_args()
+
+    ffmpeg = args.ffmpeg or find_ffmpeg()
+    concurrency_levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    server = FakeMediaServer(args.seconds, latency=args.latency, bandwidth=args.bandwidth).start()
+    # No archive or info cache, every run does the full extract, fetch and encode
+    engine = DownloadEngine(transcoder=TranscodePool(ffmpeg=ffmpeg), extractors=fake_extractors(server))
+    options = dict(default_options(None), segments=args.segments)
+
+    tracemalloc.start()
+    try:
+        results = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {
+                'seconds': args.seconds,
+                'source_bytes': len(server.body),
+                'playlist_size': args.playlist_size,
+                'runs': args.runs,
+                'latency_s': args.latency,
+                'bandwidth': args.bandwidth,
+                'segments': args.segments,
+                'ffmpeg': ffmpeg,
+            },
+            'single': bench_single(engine, options, args.runs),
+            'playlist': bench_playlist(engine, options, args.playlist_size, concurrency_levels,
+                                       len(server.body)),
+            'transcode': bench_transcode(server.body, ffmpeg, args.runs),
+            'postprocess': bench_postprocess(server.body, ffmpeg, args.runs),
+        }
+        _, peak = tracemalloc.get_traced_memory()
+        results['memory'] = {'python_peak_mb': round(peak / 1e6, 2), 'max_rss_mb': peak_rss_mb()}
+        results['stages'] = engine.metrics.summary()
+        results['server'] = {'requests': server.requests, 'bytes_sent': server.bytes_sent}
+    finally:
+        tracemalloc.stop()
+        engine.shutdown()
+        server.stop()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
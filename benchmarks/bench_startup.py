@@ -0,0 +1,113 @@
+"""Time from launching the GUI to its window being drawn.
+
+Starts the app with --measure-startup, which makes it write the time of its
+first paint to a file and close. Each launch runs in a fresh temporary folder
+so there is no history or queue to load and no resume prompt. The first
+launch is reported separately, for frozen builds it includes filling the OS
+file cache (and for --onefile the unpacking to a temp folder).
+
+- source: ``python youtube_downloader.py``
+- each --exe: a frozen build, e.g. the --onefile and --onedir outputs of build_exe.py
+- import: seconds to import youtube_downloader, works without a display
+- loaded: heavy modules already imported at first paint (should be empty)
+
+    python benchmarks/bench_startup.py --runs 5 --exe dist/YouTube_MP3_Downloader.exe
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+
+def launch(command, timeout):
+    # Seconds from process start to first paint, and what was loaded by then
+    workdir = tempfile.mkdtemp(prefix='ytmp3_startup_')
+    probe = os.path.join(workdir, 'first_paint.json')
+    try:
+        started = time.time()
+        process = subprocess.run(command + ['--measure-startup', probe], cwd=workdir,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+        exited = time.time()
+        if not os.path.exists(probe):
+            error = process.stderr.decode('utf-8', 'replace').strip().splitlines()
+            raise RuntimeError(error[-1] if error else f"exit code {process.returncode}")
+        with open(probe, 'r') as f:
+            result = json.load(f)
+        return {'first_paint_s': round(result['first_paint'] - started, 4),
+                'exit_s': round(exited - started, 4),
+                'loaded': result['loaded']}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_launch(command, runs, timeout):
+    try:
+        first = launch(command, timeout)
+        warm = [launch(command, timeout) for _ in range(runs)]
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        return {'error': str(e)}
+    return {
+        'first': first,
+        'first_paint_s': median([run['first_paint_s'] for run in warm]),
+        'exit_s': median([run['exit_s'] for run in warm]),
+        'loaded': sorted({name for run in warm for name in run['loaded']}),
+    }
+
+
+def bench_import(runs):
+    # In a fresh interpreter each time, the module cache would hide everything after the first
+    code = ("import sys, time; sys.path.insert(0, sys.argv[1]); started = time.perf_counter(); "
+            "import youtube_downloader; print(time.perf_counter() - started); "
+            "print(' '.join(name for name in ('yt_dlp', 'PIL') if name in sys.modules))")
+    times, loaded = [], set()
+    for _ in range(runs + 1):
+        output = subprocess.run([sys.executable, '-c', code, ROOT], capture_output=True,
+                                text=True, check=True).stdout.splitlines()
+        times.append(float(output[0]))
+        loaded.update(output[1].split() if len(output) > 1 else [])
+    return {'first_s': round(times[0], 4), 'median_s': round(median(times[1:]), 4),
+            'loaded': sorted(loaded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="launches per target after the first")
+    parser.add_argument('--exe', action='append', default=[], help="frozen build to measure too")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds before a launch counts as hung")
+    parser.add_argument('--output', help="also write the JSON results here")
+    args = parser.parse_args()
+
+    targets = {'source': [sys.executable, os.path.join(ROOT, 'youtube_downloader.py')]}
+    for exe in args.exe:
+        targets[os.path.relpath(exe)] = [os.path.abspath(exe)]
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'runs': args.runs},
+        'import': bench_import(args.runs),
+        'launch': {name: bench_launch(command, args.runs, args.timeout)
+                   for name, command in targets.items()},
+    }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""How long the Tk main thread is blocked by showing a preview thumbnail.
+
+Serves a synthetic 1280x720 JPEG from a local server with artificial
+latency, then drives a fake event loop that ticks every 10 ms. "before"
+fetches and resizes inline like update_preview used to; "after" uses
+ThumbnailLoader and only hands the finished image back to the loop. The
+longest gap between ticks is the stall the user would see as a frozen UI.
+
+    python benchmarks/bench_thumbnail_stall.py --latency 0.15 --runs 5
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from io import BytesIO
+from urllib.request import urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from thumbnails import ThumbnailLoader, THUMBNAIL_SIZE
+
+
+def make_jpeg():
+    image = Image.new('RGB', (1280, 720))
+    # Some structure so the encoder produces a realistic size
+    image.putdata([((x * 7) % 256, (y * 3) % 256, (x ^ y) % 256)
+                   for y in range(720) for x in range(1280)])
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def start_server(body, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_loop(task, tick=0.01, duration=None):
+    # Minimal stand-in for Tk's mainloop: callbacks queued with after(0, ...) run between ticks
+    events = queue.Queue()
+    done = threading.Event()
+    after = events.put
+    events.put(lambda: task(after, done))
+    last = time.perf_counter()
+    max_gap = 0.0
+    deadline = time.perf_counter() + (duration or 30)
+    while not done.is_set() and time.perf_counter() < deadline:
+        try:
+            callback = events.get(timeout=tick)
+        except queue.Empty:
+            callback = None
+        if callback:
+            callback()
+        now = time.perf_counter()
+        max_gap = max(max_gap, now - last)
+        last = now
+    return max_gap
+
+
+def inline_task(url):
+    def task(after, done):
+        with urlopen(url) as u:
+            raw_data = u.read()
+        image = Image.open(BytesIO(raw_data))
+        image.resize(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        done.set()
+    return task
+
+
+def background_task(loader, url):
+    def task(after, done):
+        loader.request(url, lambda image: after(done.set))
+    return task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.15, help="server response delay in seconds")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="also write the JSON results here")
+    args = parser.parse_args()
+
+    server = start_server(make_jpeg(), args.latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}/thumb.jpg"
+    loader = ThumbnailLoader()  # No cache, every run pays for fetch and decode
+
+    results = {'latency_s': args.latency, 'runs': args.runs, 'before_ms': [], 'after_ms': []}
+    for _ in range(args.runs):
+        results['before_ms'].append(round(run_loop(inline_task(url)) * 1000, 2))
+        results['after_ms'].append(round(run_loop(background_task(loader, url)) * 1000, 2))
+    for key in ('before_ms', 'after_ms'):
+        values = sorted(results[key])
+        results[key.replace('_ms', '_median_ms')] = values[len(values) // 2]
+
+    loader.shutdown()
+    server.shutdown()
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
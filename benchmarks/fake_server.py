@@ -0,0 +1,178 @@
+"""Offline stand-in for YouTube used by the benchmarks.
+
+FakeMediaServer serves a synthetic WAV tone over HTTP with Range support and
+optional latency and per-connection bandwidth limits. ``fake_extractors``
+returns yt-dlp extractor classes for ``benchvideo:<id>`` and
+``benchplaylist:<count>`` URLs whose formats point at that server, so the
+real engine, yt-dlp's HTTP downloader and ffmpeg all run as usual.
+"""
+import io
+import re
+import math
+import time
+import wave
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from yt_dlp.extractor.common import InfoExtractor
+
+SAMPLE_RATE = 44100
+
+
+def make_wav(seconds, sample_rate=SAMPLE_RATE, frequency=440.0):
+    # 16-bit stereo sine, about 172 KB per second of audio
+    period = int(sample_rate / frequency) * 8
+    frames = b''.join(struct.pack('<hh', value, value) for value in
+                      (int(12000 * math.sin(2 * math.pi * frequency * n / sample_rate))
+                       for n in range(period)))
+    count = int(seconds * sample_rate)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(frames * (count // period) + frames[:(count % period) * 4])
+    return buffer.getvalue()
+
+
+class FakeMediaServer:
+    """Serves the same WAV body for every ``/audio/<id>.wav`` path.
+
+    ``latency`` delays each response, ``bandwidth`` (bytes/s) throttles each
+    connection. Counts requests and bytes sent for the results.
+    """
+
+    def __init__(self, seconds=20, latency=0.0, bandwidth=None, chunk_size=64 * 1024):
+        self.body = make_wav(seconds)
+        self.seconds = seconds
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _count(self, requests=0, sent=0):
+        with self._lock:
+            self.requests += requests
+            self.bytes_sent += sent
+
+    def _handler(self):
+        media = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self.respond(head=True)
+
+            def do_GET(self):
+                self.respond()
+
+            def respond(self, head=False):
+                media._count(requests=1)
+                if media.latency:
+                    time.sleep(media.latency)
+                if not self.path.startswith('/audio/'):
+                    self.send_error(404)
+                    return
+                body = media.body
+                start, end = 0, len(body) - 1
+                match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+                if match and match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), end) if match.group(2) else end
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(body)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'audio/wav')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                if not head:
+                    self.send_body(body, start, end + 1)
+
+            def send_body(self, body, start, end):
+                began = time.monotonic()
+                sent = 0
+                try:
+                    while start + sent < end:
+                        chunk = body[start + sent:min(start + sent + media.chunk_size, end)]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        if media.bandwidth:
+                            ahead = sent / media.bandwidth - (time.monotonic() - began)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (ConnectionError, OSError):
+                    pass  # Client cancelled the transfer
+                media._count(sent=sent)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def fake_extractors(server):
+    """yt-dlp extractor classes that resolve bench URLs against ``server``."""
+
+    class BenchVideoIE(InfoExtractor):
+        IE_NAME = 'benchvideo'
+        _VALID_URL = r'benchvideo:(?P<id>[0-9A-Za-z_-]+)'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return {
+                'id': video_id,
+                'title': f'Bench video {video_id}',
+                'uploader': 'Benchmarks',
+                'duration': server.seconds,
+                'webpage_url': url,
+                'formats': [{
+                    'format_id': 'wav',
+                    'url': f'{server.base_url}/audio/{video_id}.wav',
+                    'ext': 'wav',
+                    'acodec': 'pcm_s16le',
+                    'vcodec': 'none',
+                    'filesize': len(server.body),
+                    'abr': 1411,
+                }],
+            }
+
+    class BenchPlaylistIE(InfoExtractor):
+        IE_NAME = 'benchplaylist'
+        _VALID_URL = r'benchplaylist:(?P<id>\d+)'
+
+        def _real_extract(self, url):
+            count = int(self._match_id(url))
+            # A generator, like the paged listings of real playlists
+            entries = (self.url_result(f'benchvideo:{n:05d}', BenchVideoIE, f'{n:05d}',
+                                       f'Bench video {n:05d}')
+                       for n in range(1, count + 1))
+            return self.playlist_result(entries, f'bench-{count}', f'Bench playlist of {count}')
+
+    return [BenchVideoIE, BenchPlaylistIE]
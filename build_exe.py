@@ -1,4 +1,5 @@
 import os
+import argparse
 import PyInstaller.__main__
 import requests
 import zipfile
@@ -34,7 +35,7 @@ def download_ffmpeg():
             shutil.rmtree(item)
     print("ffmpeg.exe ready!")
 
-def build_exe():
+def build_exe(onedir=False):
     # Check if icon file exists
     icon_path = "icon.ico"
     if not os.path.exists(icon_path):
@@ -44,7 +45,9 @@ def build_exe():
     download_ffmpeg()
     args = [
         'youtube_downloader.py',
-        '--onefile',
+        # --onefile unpacks the whole bundle to a temp folder on every launch,
+        # a onedir build starts straight from its folder
+        '--onedir' if onedir else '--onefile',
         '--windowed',
         '--name=YouTube_MP3_Downloader',
         '--add-binary=ffmpeg.exe;.',
@@ -64,5 +67,9 @@ def build_exe():
         os.remove('ffmpeg.exe')
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build YouTube_MP3_Downloader.exe with PyInstaller")
+    parser.add_argument('--onedir', action='store_true',
+                        help="build a folder with the exe and its files instead of a single exe (starts faster)")
+    args = parser.parse_args()
     os.system('pip install requests tqdm yt-dlp pillow')
-    build_exe()
+    build_exe(args.onedir)
@@ -0,0 +1,190 @@
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+YOUTUBE_ID_PATTERNS = [
+    re.compile(r'(?:youtube\.com|youtube-nocookie\.com)/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)([0-9A-Za-z_-]{11})'),
+    re.compile(r'youtu\.be/([0-9A-Za-z_-]{11})'),
+]
+
+
+def video_id_from_url(url):
+    # Lets us check the archive for single videos without a network round-trip
+    if 'list=' in url and 'v=' not in url:
+        return None
+    for pattern in YOUTUBE_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+    return None
+
+
+class DownloadArchive:
+    """Converted videos keyed by (video_id, quality), stored in SQLite.
+
+    ``encoding`` records the rest of the settings the file was made with
+    (see output_store.encode_key), so a file is only reused for the same.
+    Safe to share between download workers and the GUI thread. History pages
+    are read with a ``before`` cursor instead of an offset, and row counts are
+    cached until the archive changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._counts = {}  # (search, channel, since) -> rows
+        self._counts_version = None
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT NOT NULL,
+                    quality TEXT NOT NULL,
+                    title TEXT,
+                    channel TEXT,
+                    url TEXT,
+                    path TEXT,
+                    downloaded_at TEXT NOT NULL,
+                    PRIMARY KEY (video_id, quality)
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS downloads_by_time ON downloads (downloaded_at)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS downloads_by_channel ON downloads (channel, downloaded_at)")
+            # Archives from before tags and normalization have no encoding, those files had neither
+            columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(downloads)")]
+            if 'encoding' not in columns:
+                self._conn.execute("ALTER TABLE downloads ADD COLUMN encoding TEXT")
+        self.full_text = self._create_search_index()
+
+    def _create_search_index(self):
+        # Full-text index over titles and channels, kept in sync by triggers.
+        # Falls back to LIKE scans if this SQLite was built without FTS5.
+        try:
+            with self._lock, self._conn:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'downloads_fts'").fetchone()
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5("
+                    "title, channel, content='downloads', content_rowid='rowid')")
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS downloads_fts_insert AFTER INSERT ON downloads BEGIN
+                        INSERT INTO downloads_fts (rowid, title, channel)
+                        VALUES (new.rowid, new.title, new.channel);
+                    END""")
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS downloads_fts_delete AFTER DELETE ON downloads BEGIN
+                        INSERT INTO downloads_fts (downloads_fts, rowid, title, channel)
+                        VALUES ('delete', old.rowid, old.title, old.channel);
+                    END""")
+                if not exists:
+                    # Archives from older versions already have rows to index
+                    self._conn.execute("INSERT INTO downloads_fts (downloads_fts) VALUES ('rebuild')")
+            # INSERT OR REPLACE only fires the delete trigger with recursive triggers on
+            self._conn.execute("PRAGMA recursive_triggers = ON")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def get(self, video_id, quality):
+        if not video_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM downloads WHERE video_id = ? AND quality = ?",
+                (video_id, str(quality))).fetchone()
+        return dict(row) if row else None
+
+    def add(self, video_id, quality, title=None, channel=None, url=None, path=None, encoding=None):
+        record = {
+            'video_id': video_id,
+            'quality': str(quality),
+            'title': title,
+            'channel': channel,
+            'url': url,
+            'path': path,
+            'downloaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'encoding': encoding,
+        }
+        with self._lock, self._conn:
+            added = self._conn.execute("SELECT 1 FROM downloads WHERE video_id = ? AND quality = ?",
+                                       (video_id, record['quality'])).fetchone() is None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads "
+                "(video_id, quality, title, channel, url, path, downloaded_at, encoding) VALUES "
+                "(:video_id, :quality, :title, :channel, :url, :path, :downloaded_at, :encoding)", record)
+            self._changed(int(added))
+        return record
+
+    def remove(self, video_id, quality):
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM downloads WHERE video_id = ? AND quality = ?",
+                                         (video_id, str(quality))).rowcount
+            self._changed(-removed)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM downloads")
+            self._counts = {(None, None, None): 0}
+
+    def _changed(self, rows):
+        # Our own writes keep the total, any filtered count may have changed
+        total = self._counts.get((None, None, None))
+        self._counts = {} if total is None else {(None, None, None): total + rows}
+
+    def _filter(self, search=None, channel=None, since=None, before=None):
+        # WHERE clause for the history filters, all indexed unless FTS5 is missing.
+        # before is the (downloaded_at, id) of the last row of the previous page
+        clauses, params = [], []
+        words = (search or '').split()
+        if words and self.full_text:
+            clauses.append("rowid IN (SELECT rowid FROM downloads_fts WHERE downloads_fts MATCH ?)")
+            # Each word as a quoted prefix, so user input is never parsed as FTS syntax
+            params.append(' '.join('"' + word.replace('"', '""') + '"*' for word in words))
+        elif words:
+            for word in words:
+                pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                clauses.append("(title LIKE ? ESCAPE '\\' OR channel LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern])
+        if channel is not None:
+            clauses.append("channel = ?")
+            params.append(channel)
+        if since:
+            clauses.append("downloaded_at >= ?")
+            params.append(since)
+        if before is not None:
+            clauses.append("(downloaded_at, rowid) < (?, ?)")
+            params.extend(before)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, search=None, channel=None, since=None):
+        # COUNT(*) reads every matching row, so it is only done again after a change
+        key = (search, channel, since)
+        where, params = self._filter(search, channel, since)
+        with self._lock:
+            # Changes by another process, e.g. the command line next to the GUI
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._counts_version:
+                self._counts, self._counts_version = {}, version
+            if key not in self._counts:
+                self._counts[key] = self._conn.execute(
+                    "SELECT COUNT(*) FROM downloads" + where, params).fetchone()[0]
+            return self._counts[key]
+
+    def recent(self, limit=100, offset=0, search=None, channel=None, since=None, before=None):
+        # Newest first, one page at a time so the history loads lazily. Pass the
+        # (downloaded_at, id) of the last row as before for the next page, an
+        # offset has to skip over every row before it
+        where, params = self._filter(search, channel, since, before)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid AS id, * FROM downloads" + where +
+                " ORDER BY downloaded_at DESC, rowid DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
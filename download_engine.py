@@ -0,0 +1,594 @@
+import os
+import time
+import threading
+from concurrent.futures import Future
+from download_scheduler import DownloadScheduler, DownloadJob, JobCancelled, default_concurrency
+from transcoder import TranscodePool, downloaded_file
+from download_archive import video_id_from_url
+from metrics import MetricsRecorder
+from http_pool import HTTPConnectionPool
+from segmented import SegmentedDownload, RangeNotSupported, LinkExpired, DEFAULT_CHUNK_SIZE
+from format_planner import plan_format, is_mp3_file
+from thumbnails import fetch_thumbnail
+from postprocess import id3_tags, COVER_NAME
+from output_store import store_template, store_path, place_file, safe_name, encode_key
+from throttle import Throttle, throttle_status, retry_after
+
+QUALITIES = ["64", "128", "192", "256", "320"]
+PLAYLIST_TYPES = ('playlist', 'multi_video')
+THROTTLE_RETRIES = 3  # Transfers refused with 429/403, tried again after the backoff
+
+
+def collect(iterable, into):
+    # Pass items through while keeping a copy of each
+    for item in iterable:
+        into.append(item)
+        yield item
+
+
+class JobLogger:
+    # yt-dlp output for one job or extraction: counts retries and keeps the last error instead of printing
+    def __init__(self, job=None):
+        self.job = job
+        self.last_error = None
+
+    def debug(self, message):
+        if self.job is not None and 'Retrying' in message:
+            self.job.retries += 1
+
+    info = debug
+    warning = debug
+
+    def error(self, message):
+        self.last_error = message.replace('ERROR: ', '', 1)
+
+
+def extraction_error(ydl, url):
+    # With ignoreerrors yt-dlp returns None, the reason (private video, geo block, ...) went to its logger
+    logger = ydl.params.get('logger')
+    return Exception(getattr(logger, 'last_error', None) or f"Could not fetch video info for {url}")
+
+
+def default_options(output_dir):
+    return {
+        'quality': '192',
+        'playlist': False,
+        'output_dir': output_dir,
+        'concurrency': default_concurrency(),
+        # Range requests per file, more than 1 helps long streams that one connection can't saturate
+        'segments': 1,
+        'chunk_size': DEFAULT_CHUNK_SIZE,
+        # ID3 tags and cover art from the video info, and two-pass loudness normalization
+        'tags': True,
+        'normalize': False,
+    }
+
+
+class DownloadEngine:
+    """Download and convert logic shared by the GUI and the command line.
+
+    ``options`` is a plain dict (see default_options). A batch of downloads
+    is a DownloadScheduler from ``create_scheduler``; feed it URLs with
+    ``enqueue`` and block on ``scheduler.wait()``. Converted files are kept
+    once per video and encode settings (see output_store) and linked into
+    the output folder, with a subfolder per playlist; jobs that want the same
+    file at the same time wait for the one making it. With a DownloadArchive,
+    videos already converted at the requested quality are not converted again. With an
+    InfoCache, info extracted for a preview is reused by the download. Stage
+    timings of every job go to ``metrics``, a MetricsRecorder. ``extractors``
+    are extra yt-dlp InfoExtractor classes tried before the built-in ones
+    (the benchmarks use this for fake sites).
+    Cover art comes from ``thumbnail_cache`` when the preview already fetched it.
+    Every request and byte of every job goes through ``throttle`` (see
+    throttle.Throttle), which also turns the concurrency down when a server
+    answers 429 or 403.
+    """
+
+    def __init__(self, transcoder=None, archive=None, info_cache=None, extractors=None, metrics=None,
+                 thumbnail_cache=None, throttle=None):
+        self.transcoder = transcoder or TranscodePool()
+        self.metrics = metrics or MetricsRecorder()
+        self.throttle = throttle or Throttle()
+        self.http_pool = HTTPConnectionPool(max_idle_per_host=16, timeout=20)
+        self.archive = archive
+        self.info_cache = info_cache
+        self.thumbnail_cache = thumbnail_cache
+        self.extractors = list(extractors or [])
+        self._converting = {}  # store path -> Event set when the job making it has finished
+        self._converting_lock = threading.Lock()
+
+    def build_ydl_opts(self, options, progress_hook=None, logger=None):
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(options['output_dir'], '%(title)s.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'ignoreerrors': True,
+            'noplaylist': not options['playlist'],
+            # Partial .part files from a cancelled or crashed run are continued, not restarted
+            'continuedl': True,
+        }
+        if progress_hook is not None:
+            # Each job downloads exactly one video
+            ydl_opts['progress_hooks'] = [progress_hook]
+            ydl_opts['noplaylist'] = True
+        else:
+            # Listing only, entries are resolved by the job that downloads them
+            ydl_opts['extract_flat'] = 'in_playlist'
+        if logger is not None:
+            ydl_opts['logger'] = logger
+        if self.throttle.bandwidth.rate:
+            # yt-dlp grows its reads up to 4 MB, under a limit that would make the
+            # transfer stop and start; small fixed reads keep it smooth
+            ydl_opts['buffersize'] = max(16 * 1024, min(int(self.throttle.bandwidth.rate) // 4, 1024 * 1024))
+            ydl_opts['noresizebuffer'] = True
+        return ydl_opts
+
+    def create_ydl(self, ydl_opts, cancelled=None, source=None):
+        # Imported on first use, loading yt-dlp takes longer than drawing the whole window
+        import yt_dlp
+        if not self.extractors:
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+        else:
+            ydl = yt_dlp.YoutubeDL(ydl_opts, auto_init=False)
+            # A fresh instance per YoutubeDL, extractors keep a reference to their downloader
+            for extractor in self.extractors:
+                ydl.add_info_extractor(extractor())
+            ydl.add_default_info_extractors()
+        self.throttle_requests(ydl, cancelled, source)
+        return ydl
+
+    def throttle_requests(self, ydl, cancelled=None, source=None):
+        # Extractors and downloaders all send their requests through ydl.urlopen,
+        # source is the video or link they are for
+        throttle = self.throttle
+        urlopen = ydl.urlopen
+
+        def throttled_urlopen(*args, **kwargs):
+            requested_at = throttle.before_request(cancelled)
+            try:
+                response = urlopen(*args, **kwargs)
+            except Exception as e:
+                status = throttle_status(e)
+                if status == 403:
+                    ydl.refused = True
+                if status and (status != 403 or throttle.refused(source)):
+                    ydl.throttled = status
+                    throttle.throttled(status, requested_at,
+                                       retry_after(getattr(getattr(e, 'response', None), 'headers', None)))
+                raise
+            throttle.succeeded()
+            return response
+        ydl.urlopen = throttled_urlopen
+
+    def create_scheduler(self, options, on_update=None):
+        def job_changed(job):
+            if job.finished:
+                self.metrics.job_finished(job)
+            if on_update:
+                on_update(job)
+
+        scheduler = DownloadScheduler(lambda job: self.download_entry(scheduler, job, job.options or options),
+                                      max_workers=options.get('concurrency'),
+                                      on_update=job_changed)
+        self.throttle.attach(scheduler)
+        return scheduler
+
+    def info_key(self, url, options):
+        # The playlist option only changes the result for watch?v=...&list=... links
+        mode = 'playlist' if options['playlist'] and 'list=' in url else 'video'
+        return f"{mode}|{url}"
+
+    def extract_info(self, url, options, cancelled=None):
+        key = self.info_key(url, options)
+        if self.info_cache is not None:
+            info = self.info_cache.get(key)
+            if info:
+                return info
+
+        source = video_id_from_url(url) or url
+        with self.create_ydl(self.build_ydl_opts(options, logger=JobLogger()), cancelled, source) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if not info:
+                raise extraction_error(ydl, url)
+            info = ydl.sanitize_info(info)
+        self.cache_info(key, info)
+        return info
+
+    def refresh_info(self, url, options, cancelled=None):
+        options = dict(options, playlist=False)
+        if self.info_cache is not None:
+            self.info_cache.remove(self.info_key(url, options))
+        return self.extract_info(url, options, cancelled)
+
+    def cache_info(self, key, info):
+        # A video is downloaded under its canonical link, which is often not the one typed
+        # in (youtu.be, m.youtube.com, ?si=, &t=), so it is cached under both
+        if self.info_cache is None:
+            return
+        self.info_cache.put(key, info)
+        canonical = info.get('webpage_url')
+        if canonical and info.get('_type') not in PLAYLIST_TYPES:
+            canonical_key = self.info_key(canonical, {'playlist': False})
+            if canonical_key != key:
+                self.info_cache.put(canonical_key, info)
+
+    def archived(self, video_id, options):
+        # Only counts if the converted file is still there and was made with the same settings
+        if self.archive is None or not video_id:
+            return None
+        record = self.archive.get(video_id, options['quality'])
+        if not record or not record['path'] or not os.path.exists(record['path']):
+            return None
+        encoding = record['encoding'] or encode_key({'quality': record['quality'], 'tags': False})
+        return record if encoding == encode_key(options) else None
+
+    def reuse(self, video_id, options, title=None):
+        # Places a file converted earlier where this job wants it, returns (path, title) or None
+        if not video_id:
+            return None
+        record = self.archive.get(video_id, options['quality']) if self.archive is not None else None
+        stored = store_path(options, video_id)
+        if os.path.exists(stored):
+            source = stored
+        elif self.archived(video_id, options):
+            source = record['path']  # From before the store, or another output folder
+        else:
+            return None
+        title = title or (record['title'] if record else None)
+        if not title:
+            return None  # Can't name it yet, the job finds the title and comes back here
+        path = place_file(source, options, title, video_id)
+        if self.archive is not None and (not record or record['path'] != path
+                                         or record['encoding'] != encode_key(options)):
+            self.archive.add(video_id, options['quality'], title, record['channel'] if record else None,
+                             record['url'] if record else None, path, encode_key(options))
+        return path, title
+
+    def submit_entry(self, scheduler, url, options, title=None, index=None, video_id=None):
+        reused = self.reuse(video_id, options, title)
+        if reused:
+            return scheduler.record_skip(url, reused[1], index, video_id, reused[0], options)
+        return scheduler.submit(url, title, index, video_id, options)
+
+    def playlist_options(self, info, options):
+        # Each playlist gets its own folder, shared videos are linked rather than downloaded again
+        return dict(options, folder=safe_name(info.get('title') or info.get('id')))
+
+    def enqueue(self, scheduler, url, options, cancelled=None):
+        # cancelled, if given, stops a playlist listing early, e.g. when its queue item is paused
+        stopped = lambda: scheduler.cancelled or (cancelled is not None and cancelled())
+        # A plain video link can be checked against the archive before any request
+        if not (options['playlist'] and 'list=' in url):
+            video_id = video_id_from_url(url)
+            reused = self.reuse(video_id, options)
+            if reused:
+                scheduler.expected_total = (scheduler.expected_total or 0) + 1
+                scheduler.record_skip(url, reused[1], 1, video_id, reused[0], options)
+                return None
+
+        key = self.info_key(url, options)
+        info = self.info_cache.get(key) if self.info_cache is not None else None
+        if info is not None:
+            if info.get('_type') in PLAYLIST_TYPES:
+                self.submit_entries(scheduler, info.get('entries') or [], self.playlist_options(info, options),
+                                    stopped)
+            else:
+                self.submit_single(scheduler, info, url, options)
+            return info
+
+        scheduler.listing = True
+        try:
+            ydl_opts = self.build_ydl_opts(options, logger=JobLogger())
+            with self.create_ydl(ydl_opts, stopped, video_id_from_url(url) or url) as ydl:
+                info = self.extract_unprocessed(ydl, url)
+                if info.get('_type') not in PLAYLIST_TYPES:
+                    info = ydl.process_ie_result(info, download=False)
+                    if not info:
+                        raise extraction_error(ydl, url)
+                    info = ydl.sanitize_info(info)
+                    self.cache_info(key, info)
+                    self.submit_single(scheduler, info, url, options)
+                    return info
+                
+                # Entries are fetched page by page as we go, the first download starts
+                # as soon as the first page is in instead of after the whole listing
+                entries = []
+                complete = self.submit_entries(scheduler, collect(info.get('entries') or [], entries),
+                                               self.playlist_options(info, options), stopped)
+        finally:
+            scheduler.listing = False
+
+        info = ydl.sanitize_info(dict(info, entries=entries))
+        if complete and self.info_cache is not None:
+            self.info_cache.put(key, info)
+        return info
+
+    def extract_unprocessed(self, ydl, url):
+        # process=False leaves playlist entries as a lazy generator
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(5):
+            if not info or info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False,
+                                    ie_key=info.get('ie_key'))
+        if not info:
+            raise extraction_error(ydl, url)
+        return info
+
+    def submit_single(self, scheduler, info, url, options):
+        scheduler.expected_total = (scheduler.expected_total or 0) + 1
+        return self.submit_entry(scheduler, info.get('webpage_url') or url, options,
+                                 info.get('title'), 1, info.get('id'))
+
+    def submit_entries(self, scheduler, entries, options, cancelled=None):
+        # Returns False if the scheduler or cancelled() stopped it before all entries were submitted
+        index = 0
+        for entry in entries:
+            if cancelled is not None and cancelled():
+                return False
+            if not entry:
+                continue
+            index += 1
+            scheduler.expected_total = (scheduler.expected_total or 0) + 1
+            entry_url = entry.get('webpage_url') or entry.get('url')
+            if not self.submit_entry(scheduler, entry_url, options, entry.get('title'),
+                                     index, entry.get('id')):
+                return False
+        return True
+
+    def run(self, urls, options, on_update=None):
+        scheduler = self.create_scheduler(options, on_update)
+        try:
+            for url in urls:
+                if scheduler.cancelled:
+                    break
+                try:
+                    self.enqueue(scheduler, url, options)
+                except Exception as e:
+                    scheduler.record_failure(url, str(e), options=options)
+            scheduler.wait()
+        except BaseException:
+            # Give transfers in flight a moment to stop so their partial files are kept for the next run
+            scheduler.shutdown()
+            scheduler.wait(timeout=5)
+            raise
+        return scheduler
+
+    def download_entry(self, scheduler, job, options):
+        # Runs on a scheduler worker, YoutubeDL is not thread-safe so each job gets its own
+        job.timings['queue'] = time.monotonic() - job.created_at
+        cancelled = lambda: scheduler.is_cancelled(job)
+        with self.metrics.stage(job, 'extract'):
+            info = self.extract_info(job.url, dict(options, playlist=False), cancelled)
+        job.video_id = info.get('id', job.video_id)
+        job.title = info.get('title', job.title)
+        job.channel = info.get('uploader')
+        job.duration = info.get('duration')
+
+        # The same video can be in several queued playlists: one job converts it, the
+        # others wait for it and then link its file
+        while True:
+            converting = self.claim_store(options, job.video_id)
+            if converting is None:
+                break
+            scheduler.update_job(job, status_text="Waiting for another job with this video...")
+            while not converting.wait(0.5):
+                if scheduler.is_cancelled(job):
+                    raise JobCancelled()
+
+        try:
+            # Looked for while holding the claim, so a file another job finished just
+            # before is linked rather than made again. Playlist entries without an ID
+            # are only known now
+            reused = self.reuse(job.video_id, options, job.title)
+            if reused:
+                self.release_store(options, job.video_id)
+                scheduler.update_job(job, state=DownloadJob.SKIPPED, progress=100.0,
+                                     status_text="Already downloaded")
+                return reused[0]
+            if scheduler.is_cancelled(job):
+                raise JobCancelled()
+            result = self.convert_entry(scheduler, job, info, options, cancelled)
+        except BaseException:
+            self.release_store(options, job.video_id)
+            raise
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self.release_store(options, job.video_id))
+        else:
+            self.release_store(options, job.video_id)
+        return result
+
+    def claim_store(self, options, video_id):
+        # None if this job may make the file, else the Event of the job already making it
+        if not video_id:
+            return None
+        key = store_path(options, video_id)
+        with self._converting_lock:
+            converting = self._converting.get(key)
+            if converting is None:
+                self._converting[key] = threading.Event()
+            return converting
+
+    def release_store(self, options, video_id):
+        # Whether it worked or not, waiting jobs check the store again
+        if not video_id:
+            return
+        with self._converting_lock:
+            converting = self._converting.pop(store_path(options, video_id), None)
+        if converting is not None:
+            converting.set()
+
+    def convert_entry(self, scheduler, job, info, options, cancelled):
+        # The smallest stream that is good enough rather than always the biggest
+        plan = plan_format(info, options['quality'])
+        hook = lambda d: self.update_progress(scheduler, job, d)
+        logger = JobLogger(job)
+        ydl_opts = self.build_ydl_opts(options, hook, logger)
+        ydl_opts['outtmpl'] = store_template(options)
+        if plan is not None:
+            ydl_opts['format'] = plan.format_id
+            job.bytes_saved = plan.bytes_saved
+        with self.metrics.stage(job, 'fetch'):
+            info, source = self.fetch(scheduler, job, info, options, ydl_opts, hook, cancelled)
+            if not source:
+                raise Exception(logger.last_error or f"Could not download {job.title}")
+
+        normalize = options.get('normalize', False)
+        tags = id3_tags(info) if options.get('tags', True) else None
+        copy = plan is not None and plan.copy and not normalize
+        if copy:
+            job.transcode_avoided = self.metrics.estimate_encode(job.duration)
+            if is_mp3_file(source) and tags is None:
+                # Downloaded as MP3 at the requested bitrate, nothing left to convert
+                with self.metrics.stage(job, 'finalize'):
+                    return self.place_download(job, options, source)
+        cover = None
+        if tags is not None:
+            with self.metrics.stage(job, 'cover'):
+                cover = self.fetch_cover(info, source)
+
+        # Encode, tag and normalize on the process pool while this worker starts the next download
+        if normalize:
+            status = "Normalizing loudness..."
+        else:
+            status = "Copying MP3 audio..." if copy else "Converting to MP3..."
+        scheduler.update_job(job, status_text=status)
+        future = self.transcoder.submit(source, options['quality'], job.timings, copy, tags, cover,
+                                        normalize)
+        return self.finish_download(future, job, options)
+
+    def fetch(self, scheduler, job, info, options, ydl_opts, hook, cancelled):
+        # Returns (info, downloaded file), the file is None if yt-dlp reported an error.
+        # A transfer the server refused is tried again once the throttle's backoff is over,
+        # after a 403 with freshly extracted info as the stream link may have expired
+        refreshed = False
+        for attempt in range(THROTTLE_RETRIES + 1):
+            with self.create_ydl(ydl_opts, cancelled, job.video_id or job.url) as ydl:
+                source = None
+                try:
+                    if options.get('segments', 1) > 1:
+                        source = self.fetch_segmented(ydl, info, job, options, hook)
+                    if source is None:
+                        downloaded = ydl.process_ie_result(info, download=True)
+                        # With ignoreerrors a failed transfer still returns the info
+                        source = downloaded_file(ydl, downloaded) if downloaded else None
+                        if source and os.path.exists(source):
+                            return downloaded, source
+                    else:
+                        return info, source
+                except LinkExpired:
+                    ydl.refused = True
+            if getattr(ydl, 'refused', False) and not refreshed and attempt < THROTTLE_RETRIES:
+                # Stream links expire after a few hours, the cached info may hold an old one
+                refreshed = True
+                job.retries += 1
+                scheduler.update_job(job, status_text="Link refused, fetching video info again...")
+                info = self.refresh_info(job.url, options, cancelled)
+                continue
+            if not getattr(ydl, 'throttled', None) or attempt == THROTTLE_RETRIES:
+                return info, None
+            job.retries += 1
+            scheduler.update_job(job, status_text=f"Rate limited (HTTP {ydl.throttled}), waiting...")
+        return info, None
+
+    def fetch_segmented(self, ydl, info, job, options, hook):
+        # Returns None if the chosen format can't be fetched in ranges, yt-dlp downloads it instead
+        selected = ydl.process_ie_result(info, download=False)
+        if (not selected or selected.get('requested_formats')
+                or selected.get('protocol') not in ('http', 'https')):
+            return None
+        path = ydl.prepare_filename(selected)
+        downloader = SegmentedDownload(options['segments'], options.get('chunk_size') or DEFAULT_CHUNK_SIZE,
+                                       self.http_pool, throttle=self.throttle,
+                                       source=job.video_id or job.url)
+
+        def progress(downloaded, total, speed, eta):
+            # The segment workers already paid for these bytes in the throttle
+            hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                  'speed': speed, 'eta': eta, 'metered': True})
+        try:
+            downloader.download(selected['url'], path, selected.get('http_headers'), progress=progress)
+        except RangeNotSupported:
+            return None
+        finally:
+            job.retries += downloader.retried
+        hook({'status': 'finished'})
+        return path
+
+    def fetch_cover(self, info, source):
+        # Written next to the download for the converter process, which removes it
+        url = info.get('thumbnail')
+        if not url:
+            return None
+        try:
+            data = fetch_thumbnail(url, self.thumbnail_cache, self.http_pool)
+        except Exception:
+            return None  # A missing cover is no reason to fail the download
+        path = os.path.splitext(source)[0] + COVER_NAME
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def finish_download(self, future, job, options):
+        # A Future of the placed file: the job's result is where the user finds it, and
+        # the archive is up to date before the scheduler sees the job as done
+        placed = Future()
+
+        def done(future):
+            if future.cancelled():
+                placed.cancel()
+                return
+            if future.exception() is not None:
+                job.error_stage = 'ffmpeg'
+                placed.set_exception(future.exception())
+                return
+            try:
+                with self.metrics.stage(job, 'finalize'):
+                    placed.set_result(self.place_download(job, options, future.result()))
+            except Exception as e:
+                placed.set_exception(e)
+        future.add_done_callback(done)
+        return placed
+
+    def place_download(self, job, options, stored):
+        path = place_file(stored, options, job.title, job.video_id)
+        self.archive_download(job, options, path)
+        return path
+
+    def archive_download(self, job, options, path):
+        if self.archive is not None and job.video_id:
+            self.archive.add(job.video_id, options['quality'], job.title, job.channel, job.url, path,
+                             encode_key(options))
+
+    def update_progress(self, scheduler, job, d):
+        # yt-dlp lets exceptions from hooks through, which stops the transfer and keeps the .part file
+        if scheduler.is_cancelled(job):
+            raise JobCancelled()
+        if d['status'] == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            if not d.get('metered'):
+                self.meter(scheduler, job, downloaded)
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            progress = min(downloaded * 100.0 / total, 100.0) if total else job.progress
+            scheduler.update_job(job, progress=progress, downloaded_bytes=downloaded,
+                                 total_bytes=total, speed=d.get('speed'), eta=d.get('eta'),
+                                 status_text="Downloading")
+        elif d['status'] == 'finished':
+            scheduler.update_job(job, progress=100.0, status_text="Waiting for converter...")
+
+    def meter(self, scheduler, job, downloaded):
+        # Charges the bytes read since the last hook to the bandwidth limit, sleeping here
+        # holds up the transfer itself. The first hook only sets the mark, for a continued
+        # .part file downloaded_bytes starts at what is already on disk
+        last = getattr(job, 'metered_bytes', None)
+        job.metered_bytes = downloaded
+        if last is not None:
+            # Counting restarts for the second stream of a merged format
+            self.throttle.transferred(downloaded - last if downloaded >= last else downloaded,
+                                      lambda: scheduler.is_cancelled(job))
+
+    def shutdown(self, wait=True):
+        self.transcoder.shutdown(wait=wait)
+        self.http_pool.close()
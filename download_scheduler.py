@@ -0,0 +1,246 @@
+import os
+import time
+import threading
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    # Raised from a progress hook to abort the transfer in flight
+    pass
+
+
+def default_concurrency():
+    # Downloads are network bound, so run a few per core but stay polite
+    return max(2, min(8, os.cpu_count() or 2))
+
+
+class DownloadJob:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    SKIPPED = 'skipped'
+
+    FINISHED_STATES = (DONE, FAILED, CANCELLED, SKIPPED)
+
+    def __init__(self, job_id, url, title=None, index=None, video_id=None, options=None):
+        self.id = job_id
+        self.url = url
+        self.title = title or url
+        self.index = index
+        self.video_id = video_id
+        self.options = options
+        self.cancel_requested = False
+        self.channel = None
+        self.state = DownloadJob.QUEUED
+        self.progress = 0.0
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None  # bytes per second
+        self.eta = None  # seconds
+        self.status_text = "Queued"
+        self.error = None
+        self.result = None
+        self.created_at = time.monotonic()
+        self.timings = {}  # stage -> seconds, see metrics.STAGES
+        self.retries = 0
+        self.duration = None  # seconds of audio
+        self.bytes_saved = 0  # compared to downloading bestaudio
+        self.transcode_avoided = 0.0  # estimated encode seconds we didn't need
+
+    @property
+    def finished(self):
+        return self.state in DownloadJob.FINISHED_STATES
+
+
+class DownloadScheduler:
+    """Runs download jobs on a bounded worker pool.
+
+    ``worker`` is called with a DownloadJob on a pool thread and does the
+    actual transfer. If it returns a Future (e.g. a pending transcode) the
+    worker slot is freed for the next download and the job finishes when
+    the future does. ``submit`` blocks once ``max_workers + max_pending``
+    jobs are downloading or queued, so huge playlists never pile up in memory.
+    ``set_limit`` lowers how many of the workers may download at once, e.g.
+    while a server is rate limiting us.
+    ``on_update`` is called (from worker threads) whenever a job changes.
+    """
+
+    def __init__(self, worker, max_workers=None, max_pending=None, on_update=None):
+        self.max_workers = max_workers or default_concurrency()
+        self.max_pending = self.max_workers * 2 if max_pending is None else max_pending
+        self._worker = worker
+        self._on_update = on_update
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='download')
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._ids = itertools.count(1)
+        self.limit = self.max_workers
+        self._running = 0
+        self.jobs = []
+        self.cancelled = False
+        self.expected_total = None
+        self.listing = False  # Still discovering playlist entries, expected_total will grow
+
+    def submit(self, url, title=None, index=None, video_id=None, options=None):
+        # Wait for room in the queue, but give up if cancelled meanwhile
+        while not self._slots.acquire(timeout=0.2):
+            if self.cancelled:
+                return None
+        if self.cancelled:
+            self._slots.release()
+            return None
+
+        job = DownloadJob(next(self._ids), url, title, index, video_id, options)
+        with self._lock:
+            self.jobs.append(job)
+        self._notify(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def record_failure(self, url, error, title=None, options=None):
+        # For URLs that never made it to a worker, e.g. info extraction failed
+        job = DownloadJob(next(self._ids), url, title, options=options)
+        job.state = DownloadJob.FAILED
+        job.error = error
+        job.status_text = "Failed"
+        with self._lock:
+            self.jobs.append(job)
+        self._notify(job)
+        return job
+
+    def record_skip(self, url, title=None, index=None, video_id=None, result=None, options=None):
+        # Already converted, nothing to run
+        job = DownloadJob(next(self._ids), url, title, index, video_id, options)
+        job.state = DownloadJob.SKIPPED
+        job.progress = 100.0
+        job.result = result
+        job.status_text = "Already downloaded"
+        with self._lock:
+            self.jobs.append(job)
+        self._notify(job)
+        return job
+
+    def set_limit(self, limit):
+        with self._lock:
+            self.limit = max(1, min(limit, self.max_workers))
+            self._changed.notify_all()
+
+    def _run(self, job):
+        started = False
+        try:
+            # A worker thread beyond the current limit waits here, still queued
+            with self._lock:
+                self._changed.wait_for(lambda: self._running < self.limit
+                                       or self.cancelled or job.cancel_requested)
+                started = not (self.cancelled or job.cancel_requested)
+                if started:
+                    self._running += 1
+            if not started:
+                self.update_job(job, state=DownloadJob.CANCELLED, status_text="Cancelled")
+                return
+            self.update_job(job, state=DownloadJob.RUNNING, status_text="Starting...")
+            result = self._worker(job)
+            if isinstance(result, Future):
+                self.update_job(job, state=DownloadJob.PROCESSING)
+                result.add_done_callback(lambda future: self._finish(job, future))
+            else:
+                job.result = result
+                if job.state != DownloadJob.SKIPPED:
+                    self.update_job(job, state=DownloadJob.DONE, progress=100.0, status_text="Done")
+        except JobCancelled:
+            self.update_job(job, state=DownloadJob.CANCELLED, status_text="Cancelled")
+        except Exception as e:
+            if self.is_cancelled(job):
+                # e.g. yt-dlp reporting the aborted transfer as an extraction or download error
+                self.update_job(job, state=DownloadJob.CANCELLED, status_text="Cancelled")
+            else:
+                self.update_job(job, state=DownloadJob.FAILED, error=str(e), status_text="Failed")
+        finally:
+            if started:
+                with self._lock:
+                    self._running -= 1
+                    self._changed.notify_all()
+            self._slots.release()
+
+    def _finish(self, job, future):
+        try:
+            job.result = future.result()
+            self.update_job(job, state=DownloadJob.DONE, progress=100.0, status_text="Done")
+        except Exception as e:
+            self.update_job(job, state=DownloadJob.FAILED, error=str(e), status_text="Failed")
+
+    def update_job(self, job, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                setattr(job, key, value)
+        self._notify(job)
+        if 'state' in changes:
+            # After the callbacks, so wait() returns only once listeners have seen the final state
+            with self._lock:
+                self._changed.notify_all()
+
+    def _notify(self, job):
+        if self._on_update:
+            try:
+                self._on_update(job)
+            except Exception:
+                pass
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.jobs)
+
+    def counts(self):
+        counts = {state: 0 for state in (DownloadJob.QUEUED, DownloadJob.RUNNING, DownloadJob.PROCESSING,
+                                         DownloadJob.DONE, DownloadJob.FAILED, DownloadJob.CANCELLED,
+                                         DownloadJob.SKIPPED)}
+        for job in self.snapshot():
+            counts[job.state] += 1
+        return counts
+
+    def overall_progress(self):
+        jobs = self.snapshot()
+        total = max(len(jobs), self.expected_total or 0)
+        if not total:
+            return 0.0
+        return sum(100.0 if job.finished else job.progress for job in jobs) / total
+
+    @property
+    def active(self):
+        return any(not job.finished for job in self.snapshot())
+
+    def is_cancelled(self, job):
+        return self.cancelled or job.cancel_requested
+
+    def cancel_job(self, job):
+        # Queued jobs are dropped now, running ones stop at their next progress callback
+        job.cancel_requested = True
+        if job.state == DownloadJob.QUEUED:
+            self.update_job(job, state=DownloadJob.CANCELLED, status_text="Cancelled")
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            self._changed.notify_all()
+        for job in self.snapshot():
+            if job.state == DownloadJob.QUEUED:
+                self.update_job(job, state=DownloadJob.CANCELLED, status_text="Cancelled")
+
+    def wait(self, timeout=None):
+        # Waits on job states rather than joining pool threads: a join interrupted
+        # by Ctrl+C leaves the thread flagged as stopped and exit would not wait for it
+        with self._lock:
+            done = self._changed.wait_for(lambda: all(job.finished for job in self.jobs), timeout)
+        if done:
+            self._executor.shutdown(wait=False)
+        return done
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,103 @@
+import os
+
+# How many kbps of MP3 one kbps of each codec is worth, roughly. A 130k Opus
+# stream is as good as a 192k MP3, so there is nothing to gain from a bigger download.
+CODEC_EFFICIENCY = {'opus': 1.5, 'vorbis': 1.2, 'aac': 1.2, 'mp4a': 1.2, 'mp3': 1.0}
+MP3_CODECS = ('mp3',)
+
+
+def codec_name(fmt):
+    acodec = (fmt.get('acodec') or '').lower()
+    if acodec and acodec != 'none':
+        return acodec.split('.')[0]
+    # Direct links often only tell us the extension
+    return (fmt.get('ext') or '').lower()
+
+
+def audio_bitrate(fmt):
+    return fmt.get('abr') or (fmt.get('tbr') if fmt.get('vcodec') == 'none' else None)
+
+
+def is_drc(fmt):
+    # YouTube's dynamic range compressed variants, e.g. 251-drc
+    return (fmt.get('format_id') or '').lower().endswith('-drc') or 'DRC' in (fmt.get('format_note') or '')
+
+
+def track_rank(fmt):
+    # The original audio track ranks above dubbed ones, damaged formats last, as in bestaudio
+    language = fmt.get('language_preference')
+    return (-1 if language is None else language, fmt.get('preference') or 0)
+
+
+def estimated_size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and duration and fmt.get('tbr'):
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return size
+
+
+class FormatPlan:
+    """Which format to download for a job and whether it still needs encoding.
+
+    ``copy`` means the stream is MP3 already at about the requested bitrate,
+    so it is used as is (or remuxed) instead of being re-encoded.
+    ``bytes_saved`` is how much smaller it is than what ``bestaudio`` picks.
+    """
+
+    def __init__(self, format_id, copy=False, size=None, bytes_saved=0, reason=''):
+        self.format_id = format_id
+        self.copy = copy
+        self.size = size
+        self.bytes_saved = bytes_saved
+        self.reason = reason
+
+
+def plan_format(info, quality):
+    """Smallest audio stream in ``info['formats']`` good enough for ``quality`` kbps.
+
+    Returns None when there is nothing to choose from, the default
+    ``bestaudio/best`` selection is used then.
+    """
+    formats = [fmt for fmt in info.get('formats') or []
+               if fmt.get('format_id') and fmt.get('acodec') != 'none']
+    audio_only = [fmt for fmt in formats if fmt.get('vcodec') == 'none']
+    if not audio_only:
+        return None
+    # Smaller isn't better if it is a dubbed track or has its dynamics squashed
+    audio_only = [fmt for fmt in audio_only if not is_drc(fmt)] or audio_only
+    top = max(track_rank(fmt) for fmt in audio_only)
+    audio_only = [fmt for fmt in audio_only if track_rank(fmt) == top]
+    target = float(quality)
+    duration = info.get('duration')
+    # yt-dlp lists formats worst to best, the last audio-only one is what bestaudio gets
+    best = audio_only[-1]
+    best_size = estimated_size(best, duration)
+
+    def plan(fmt, copy, reason):
+        size = estimated_size(fmt, duration)
+        saved = max(0, int(best_size - size)) if best_size and size else 0
+        return FormatPlan(fmt['format_id'], copy, size, saved, reason)
+
+    # Already MP3 at (about) the requested bitrate, no need to encode at all
+    for fmt in audio_only:
+        bitrate = audio_bitrate(fmt)
+        if codec_name(fmt) in MP3_CODECS and bitrate and target * 0.9 <= bitrate <= target * 1.25:
+            return plan(fmt, True, f"mp3 {bitrate:.0f}k")
+
+    candidates = []
+    for fmt in audio_only:
+        bitrate = audio_bitrate(fmt)
+        size = estimated_size(fmt, duration)
+        if not bitrate or not size:
+            continue
+        effective = bitrate * CODEC_EFFICIENCY.get(codec_name(fmt), 1.0)
+        if effective >= target:
+            candidates.append((size, -effective, fmt))
+    if not candidates:
+        return plan(best, False, "best available")
+    size, effective, fmt = min(candidates, key=lambda candidate: candidate[:2])
+    return plan(fmt, False, f"{codec_name(fmt)} {audio_bitrate(fmt):.0f}k")
+
+
+def is_mp3_file(path):
+    return os.path.splitext(path)[1].lower() == '.mp3'
@@ -0,0 +1,202 @@
+import tkinter as tk
+from tkinter import ttk
+from tkinter import font as tkfont
+from collections import OrderedDict
+
+
+class HistoryRecord:
+    # One archive row, slotted so thousands of cached rows stay small
+    __slots__ = ('video_id', 'quality', 'title', 'channel', 'url', 'path', 'downloaded_at')
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row.get(name))
+
+    @property
+    def key(self):
+        return (self.video_id, self.quality)
+
+
+class HistoryStore:
+    """Random access by row number into the filtered download history.
+
+    Rows come from the DownloadArchive in blocks and only the most recently
+    used blocks are kept, so memory and the cost of a lookup don't depend on
+    how long the history is. A block is read from where the one before it
+    ended; only a jump to a block not reached yet has to skip rows by offset.
+    Call ``invalidate`` after the archive changes.
+    """
+
+    def __init__(self, archive, block_size=200, max_blocks=8):
+        self.archive = archive
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.filters = {}
+        self._blocks = OrderedDict()  # block number -> [HistoryRecord]
+        self._starts = {}  # block number -> (downloaded_at, id) of the row before it
+        self._count = None
+
+    def set_filters(self, search=None, channel=None, since=None):
+        self.filters = {'search': search or None, 'channel': channel, 'since': since or None}
+        self.invalidate()
+
+    def invalidate(self):
+        self._blocks.clear()
+        self._starts.clear()
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.archive.count(**self.filters)
+        return self._count
+
+    def _block(self, number):
+        block = self._blocks.get(number)
+        if block is None:
+            before = self._starts.get(number)
+            if number and before is None:
+                rows = self.archive.recent(self.block_size, number * self.block_size, **self.filters)
+            else:
+                rows = self.archive.recent(self.block_size, before=before, **self.filters)
+            if len(rows) == self.block_size:
+                self._starts[number + 1] = (rows[-1]['downloaded_at'], rows[-1]['id'])
+            block = [HistoryRecord(row) for row in rows]
+            self._blocks[number] = block
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(number)
+        return block
+
+    def rows(self, start, count):
+        records = []
+        while count > 0:
+            number, offset = divmod(start, self.block_size)
+            block = self._block(number)
+            chunk = block[offset:offset + count]
+            if not chunk:
+                break
+            records.extend(chunk)
+            start += len(chunk)
+            count -= len(chunk)
+        return records
+
+
+class HistoryView:
+    """Listbox that only holds the rows currently on screen.
+
+    The scrollbar is driven by row numbers in the HistoryStore instead of by
+    the Listbox contents, so a history of any length opens and scrolls by
+    loading one screenful of rows.
+    """
+
+    def __init__(self, parent, store, format_row, **listbox_options):
+        self.store = store
+        self.format_row = format_row
+        self.offset = 0
+        self.visible = 10
+        self.records = []
+        self.selected_key = None
+
+        self.scrollbar = ttk.Scrollbar(parent, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(parent, exportselection=False, **listbox_options)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+
+        self.listbox.bind('<Configure>', self.on_resize)
+        self.listbox.bind('<<ListboxSelect>>', self.on_select)
+        self.listbox.bind('<MouseWheel>', self.on_mousewheel)
+        self.listbox.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.listbox.bind('<Button-5>', lambda e: self.scroll(3))
+        self.listbox.bind('<Up>', lambda e: self.move_selection(-1))
+        self.listbox.bind('<Down>', lambda e: self.move_selection(1))
+        self.listbox.bind('<Prior>', lambda e: self.move_selection(-self.visible))
+        self.listbox.bind('<Next>', lambda e: self.move_selection(self.visible))
+
+    def row_height(self):
+        font = tkfont.Font(font=self.listbox.cget('font'))
+        return font.metrics('linespace') + 1 + 2 * int(self.listbox.cget('selectborderwidth'))
+
+    def on_resize(self, event):
+        visible = max(1, event.height // self.row_height())
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    def refresh(self, invalidate=False):
+        if invalidate:
+            self.store.invalidate()
+        total = len(self.store)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        # One extra row so a partly visible last line isn't left blank
+        self.records = self.store.rows(self.offset, self.visible + 1)
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *[self.format_row(record) for record in self.records])
+        for index, record in enumerate(self.records):
+            if record.key == self.selected_key:
+                self.listbox.selection_set(index)
+        if total > self.visible:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll(self, rows):
+        self.offset = max(0, self.offset + rows)
+        self.refresh()
+        return 'break'
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.offset = int(float(amount) * len(self.store))
+            self.refresh()
+        elif action == 'scroll':
+            self.scroll(int(amount) * (self.visible if unit == 'pages' else 1))
+
+    def on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll(-3 * steps)
+
+    def on_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.records):
+            self.selected_key = self.records[selection[0]].key
+
+    def move_selection(self, rows):
+        total = len(self.store)
+        if not total:
+            return 'break'
+        selection = self.listbox.curselection()
+        current = self.offset + selection[0] if selection else self.offset - 1
+        target = max(0, min(total - 1, current + rows))
+        # Scroll just enough to keep the target row on screen
+        if target < self.offset:
+            self.offset = target
+        elif target >= self.offset + self.visible:
+            self.offset = target - self.visible + 1
+        self.select_row(target - self.offset)
+        return 'break'
+
+    def select_row(self, index):
+        self.refresh()
+        if 0 <= index < len(self.records):
+            self.selected_key = self.records[index].key
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(index)
+            self.listbox.activate(index)
+
+    def nearest(self, y):
+        index = self.listbox.nearest(y)
+        return index if 0 <= index < len(self.records) else -1
+
+    def selected(self):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.records):
+            return self.records[selection[0]]
+        return None
+
+    def bind(self, sequence, callback):
+        self.listbox.bind(sequence, callback)
+
+    def configure(self, **options):
+        self.listbox.configure(**options)
@@ -0,0 +1,92 @@
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class HTTPConnectionPool:
+    """Keep-alive connections per host, so repeated requests to the same
+    server (thumbnails from i.ytimg.com, range requests for one stream)
+    skip the TCP and TLS handshakes. Safe to share between threads."""
+
+    def __init__(self, max_idle_per_host=2, timeout=10):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, scheme, host):
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop()
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, timeout=self.timeout)
+
+    def _release(self, scheme, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def open(self, url, headers=None, redirects=5):
+        """Sends a GET and returns ``(response, release)`` without reading the body.
+
+        Call ``release()`` when done with the response: the connection goes
+        back to the pool if the body was read to the end, otherwise it is closed.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {'User-Agent': 'Mozilla/5.0', 'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
+
+        # A pooled connection may have been closed by the server, retry once on a fresh one
+        for attempt in range(2):
+            connection = self._acquire(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            break
+
+        def release():
+            if response.isclosed() and not response.will_close:
+                self._release(parts.scheme, parts.netloc, connection)
+            else:
+                connection.close()
+
+        if response.status in REDIRECT_STATUSES and redirects:
+            location = response.getheader('Location')
+            if location:
+                response.read()
+                release()
+                if location.startswith('/'):
+                    location = f"{parts.scheme}://{parts.netloc}{location}"
+                return self.open(location, headers, redirects - 1)
+        return response, release
+
+    def get(self, url, headers=None, redirects=5):
+        response, release = self.open(url, headers, redirects)
+        try:
+            body = response.read()
+        finally:
+            release()
+        if response.status != 200:
+            raise OSError(f"HTTP {response.status} for {url}")
+        return body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
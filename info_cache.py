@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class DiskLRUCache:
+    """Byte-valued cache kept in memory and mirrored to files in ``directory``.
+
+    Entries older than ``ttl`` seconds are dropped. Each tier evicts its least
+    recently used entries once it grows past its byte budget. Subclasses
+    override ``encode``/``decode`` to store other values.
+    """
+
+    def __init__(self, directory, ttl, max_memory_bytes=16 * 1024 * 1024,
+                 max_disk_bytes=128 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> (stored_at, data)
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def encode(self, value):
+        return value
+
+    def decode(self, data):
+        return data
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if now - item[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return self.decode(item[1])
+                self._drop_memory(key)
+
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if now - stat.st_mtime > self.ttl:
+                self._remove_file(path, stat.st_size)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # atime tracks use for disk eviction, mtime stays the write time for the TTL
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            return None
+
+        with self._lock:
+            self._remember(key, stat.st_mtime, data)
+        return self.decode(data)
+
+    def put(self, key, value):
+        data = self.encode(value)
+        path = self._path(key)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+            written = True
+        except OSError:
+            written = False  # Disk tier unavailable, keep the memory copy anyway
+        with self._lock:
+            self._remember(key, time.time(), data)
+            if written and self._disk_bytes is not None:
+                self._disk_bytes += len(data) - old_size
+        if written:
+            self._evict_disk()
+
+    def remove(self, key):
+        with self._lock:
+            self._drop_memory(key)
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self._remove_file(path, size)
+
+    def _remember(self, key, stored_at, data):
+        self._drop_memory(key)
+        self._memory[key] = (stored_at, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            self._drop_memory(next(iter(self._memory)))
+
+    def _drop_memory(self, key):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= len(item[1])
+
+    def _remove_file(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        return entries
+
+    def _evict_disk(self):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._scan())
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+        # Least recently read first, down to 80% so we don't rescan on every put
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        with self._lock:
+            self._disk_bytes = total
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes * 0.8:
+                break
+            self._remove_file(path, size)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for _, size, path in self._scan():
+            self._remove_file(path, size)
+
+
+class InfoCache(DiskLRUCache):
+    # yt-dlp info dicts, stored as JSON so every get returns a fresh copy callers may modify
+    def __init__(self, directory, ttl=3600, **kwargs):
+        # Stream URLs in the info expire after a few hours, so keep the TTL short
+        super().__init__(directory, ttl, **kwargs)
+
+    def encode(self, value):
+        return json.dumps(value, ensure_ascii=False, default=str).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+def thumbnail_cache(directory):
+    # Preview images as served and resized, they don't change so they can live for a week
+    return DiskLRUCache(directory, ttl=7 * 24 * 3600, max_memory_bytes=4 * 1024 * 1024,
+                        max_disk_bytes=32 * 1024 * 1024)
@@ -0,0 +1,57 @@
+import json
+import sqlite3
+import threading
+from download_scheduler import DownloadJob
+
+# Jobs in these states are moved into the queue; finished and failed ones are dropped
+RESUMABLE_STATES = (DownloadJob.QUEUED, DownloadJob.RUNNING, DownloadJob.PROCESSING,
+                    DownloadJob.CANCELLED)
+
+
+class JobStateStore:
+    """Unfinished download jobs recorded by versions before the UrlQueue.
+
+    Only read now: import_unfinished moves them into the queue and clears the
+    table. Their .part files are still there, so yt-dlp continues them from
+    the last byte.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    video_id TEXT,
+                    options TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    downloaded_bytes INTEGER,
+                    total_bytes INTEGER,
+                    updated_at REAL NOT NULL
+                )""")
+
+    def unfinished(self):
+        placeholders = ', '.join('?' * len(RESUMABLE_STATES))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE state IN ({placeholders}) ORDER BY updated_at",
+                RESUMABLE_STATES).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['options'] = json.loads(record['options'])
+            records.append(record)
+        return records
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
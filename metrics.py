@@ -0,0 +1,214 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Where a job's time goes, in order. The two waits show whether jobs are held
+# up by the download slots or by the converter processes. cover (fetching the
+# cover art) and loudness (the analysis pass of normalization) are optional.
+STAGES = ('queue', 'extract', 'fetch', 'cover', 'convert_wait', 'loudness', 'ffmpeg', 'finalize')
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# ffmpeg seconds per second of audio until we have measured our own, libmp3lame runs about 50x realtime
+DEFAULT_ENCODE_RATE = 0.02
+
+
+class MetricsRecorder:
+    """Per-stage timings, bytes, retries and errors of finished jobs, and
+    what the format planner saved (bytes not downloaded, encodes not run).
+
+    Workers time their stages with ``stage``; the numbers are kept on the
+    job (``job.timings``) until ``job_finished`` folds them into the totals
+    and, with a ``log_path``, appends one JSON line per job.
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self.jobs = {}  # final state -> count
+        self.errors = {}  # stage -> count
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.stage_counts = {stage: 0 for stage in STAGES}
+        self.stage_buckets = {stage: [0] * len(BUCKETS) for stage in STAGES}
+        self.bytes = 0
+        self.retries = 0
+        self.bytes_saved = 0
+        self.transcode_avoided = 0.0
+        self.encoded_audio = 0.0  # seconds of audio encoded, for the encode rate
+        self.encode_seconds = 0.0
+
+    @contextmanager
+    def stage(self, job, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            # The first stage that raised is the one the error is counted against
+            if not getattr(job, 'error_stage', None):
+                job.error_stage = name
+            raise
+        finally:
+            job.timings[name] = job.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def job_finished(self, job):
+        if getattr(job, 'metrics_recorded', False):
+            return
+        job.metrics_recorded = True
+        timings = dict(job.timings)
+        error_stage = (getattr(job, 'error_stage', None) or 'listing') if job.error else None
+        with self._lock:
+            self.jobs[job.state] = self.jobs.get(job.state, 0) + 1
+            if error_stage:
+                self.errors[error_stage] = self.errors.get(error_stage, 0) + 1
+            for stage, seconds in timings.items():
+                if stage not in self.stage_seconds:
+                    continue
+                self.stage_seconds[stage] += seconds
+                self.stage_counts[stage] += 1
+                for index, bound in enumerate(BUCKETS):
+                    if seconds <= bound:
+                        self.stage_buckets[stage][index] += 1
+            self.bytes += job.downloaded_bytes or 0
+            self.retries += job.retries
+            self.bytes_saved += job.bytes_saved
+            self.transcode_avoided += job.transcode_avoided
+            if job.duration and 'ffmpeg' in timings and not job.transcode_avoided:
+                self.encoded_audio += job.duration
+                self.encode_seconds += timings['ffmpeg']
+
+        if self.log_path:
+            self.write_log(job, timings, error_stage)
+
+    def write_log(self, job, timings, error_stage):
+        fetch = timings.get('fetch')
+        record = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'url': job.url,
+            'video_id': job.video_id,
+            'title': job.title,
+            'state': job.state,
+            'timings': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            'total_s': round(sum(timings.values()), 4),
+            'bytes': job.downloaded_bytes,
+            'throughput': round(job.downloaded_bytes / fetch) if fetch and job.downloaded_bytes else None,
+            'retries': job.retries,
+            'bytes_saved': job.bytes_saved,
+            'transcode_avoided_s': round(job.transcode_avoided, 3),
+            'error': job.error,
+            'error_stage': error_stage,
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        try:
+            with self._lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError:
+            pass  # Metrics must never fail a download
+
+    def estimate_encode(self, duration):
+        # What encoding ``duration`` seconds of audio would have cost, at the rate seen so far
+        with self._lock:
+            rate = self.encode_seconds / self.encoded_audio if self.encoded_audio else DEFAULT_ENCODE_RATE
+        return (duration or 0) * rate
+
+    def summary(self):
+        # Totals per stage, the slowest overall is where to look first
+        with self._lock:
+            stages = {stage: {'count': self.stage_counts[stage],
+                              'total_s': round(self.stage_seconds[stage], 3),
+                              'avg_s': round(self.stage_seconds[stage] / self.stage_counts[stage], 3)
+                              if self.stage_counts[stage] else None}
+                      for stage in STAGES}
+            fetch = self.stage_seconds['fetch']
+            return {
+                'jobs': dict(self.jobs),
+                'stages': stages,
+                'bottleneck': max(STAGES, key=lambda stage: self.stage_seconds[stage])
+                if any(self.stage_seconds.values()) else None,
+                'bytes': self.bytes,
+                'throughput': round(self.bytes / fetch) if fetch else None,
+                'retries': self.retries,
+                'bytes_saved': self.bytes_saved,
+                'transcode_avoided_s': round(self.transcode_avoided, 3),
+                'errors': dict(self.errors),
+            }
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                '# HELP ytmp3_jobs_total Finished download jobs by final state.',
+                '# TYPE ytmp3_jobs_total counter',
+            ]
+            lines += [f'ytmp3_jobs_total{{state="{state}"}} {count}' for state, count in self.jobs.items()]
+            lines += [
+                '# HELP ytmp3_stage_seconds Time spent per job in each stage.',
+                '# TYPE ytmp3_stage_seconds histogram',
+            ]
+            for stage in STAGES:
+                for bound, count in zip(BUCKETS, self.stage_buckets[stage]):
+                    lines.append(f'ytmp3_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'ytmp3_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self.stage_counts[stage]}')
+                lines.append(f'ytmp3_stage_seconds_sum{{stage="{stage}"}} {self.stage_seconds[stage]:.6f}')
+                lines.append(f'ytmp3_stage_seconds_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+            lines += [
+                '# HELP ytmp3_downloaded_bytes_total Bytes fetched from the network.',
+                '# TYPE ytmp3_downloaded_bytes_total counter',
+                f'ytmp3_downloaded_bytes_total {self.bytes}',
+                '# HELP ytmp3_retries_total Retries reported by yt-dlp.',
+                '# TYPE ytmp3_retries_total counter',
+                f'ytmp3_retries_total {self.retries}',
+                '# HELP ytmp3_bytes_saved_total Bytes not downloaded thanks to a smaller format.',
+                '# TYPE ytmp3_bytes_saved_total counter',
+                f'ytmp3_bytes_saved_total {self.bytes_saved}',
+                '# HELP ytmp3_transcode_avoided_seconds_total Estimated encode time skipped for MP3 sources.',
+                '# TYPE ytmp3_transcode_avoided_seconds_total counter',
+                f'ytmp3_transcode_avoided_seconds_total {self.transcode_avoided:.6f}',
+                '# HELP ytmp3_errors_total Failed jobs by the stage that failed.',
+                '# TYPE ytmp3_errors_total counter',
+            ]
+            lines += [f'ytmp3_errors_total{{stage="{stage}"}} {count}' for stage, count in self.errors.items()]
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves ``/metrics`` (Prometheus text) and ``/metrics.json`` on localhost."""
+
+    def __init__(self, recorder, port, host='127.0.0.1'):
+        self.recorder = recorder
+        self.port = port
+        self.host = host
+        self._server = None
+
+    def start(self):
+        # Most runs never serve metrics, http.server is only imported when one does
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        recorder = self.recorder
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = recorder.render_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(recorder.summary()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
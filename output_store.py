@@ -0,0 +1,82 @@
+import os
+import shutil
+import filecmp
+
+# Converted files live here once, keyed by video ID and encode settings, and are
+# linked to wherever they should appear (the output folder, one folder per playlist)
+STORE_DIR = '.audio_store'
+
+
+def encode_key(options):
+    # Everything that changes the MP3's bytes, so different settings never share a file
+    key = f"{options['quality']}k"
+    if options.get('normalize'):
+        key += '-loudnorm'
+    if not options.get('tags', True):
+        key += '-notags'
+    return key
+
+
+def store_dir(options):
+    return os.path.join(options['output_dir'], STORE_DIR)
+
+
+def store_template(options):
+    # yt-dlp output template for downloads, the converter puts the .mp3 next to them
+    return os.path.join(store_dir(options), f"%(id)s-{encode_key(options)}.%(ext)s")
+
+
+def store_path(options, video_id):
+    return os.path.join(store_dir(options), f"{video_id}-{encode_key(options)}.mp3")
+
+
+def safe_name(title):
+    from yt_dlp.utils import sanitize_filename  # Same rules as yt-dlp's own file names
+    return sanitize_filename(title or '').strip() or 'untitled'
+
+
+def same_file(first, second):
+    try:
+        return os.path.samefile(first, second) or filecmp.cmp(first, second, shallow=False)
+    except OSError:
+        return False
+
+
+def link_file(source, target):
+    # A hardlink costs no space; symlinks where those aren't possible (FAT, across
+    # drives), and a copy as the last resort (Windows without symlink rights)
+    try:
+        os.link(source, target)
+        return
+    except (OSError, AttributeError):
+        pass
+    try:
+        os.symlink(os.path.abspath(source), target)
+        return
+    except (OSError, NotImplementedError, AttributeError):
+        pass
+    shutil.copy2(source, target)
+
+
+def place_file(source, options, title, video_id):
+    """Makes ``source`` appear as ``<title>.mp3`` in the output folder, or in
+    the playlist's subfolder when ``options['folder']`` is set, and returns
+    that path. A different file already using the name is kept and this one
+    gets the video ID added to its name instead of overwriting it.
+    """
+    folder = options['output_dir']
+    if options.get('folder'):
+        folder = os.path.join(folder, options['folder'])
+    os.makedirs(folder, exist_ok=True)
+    name = safe_name(title)
+    for candidate in (f"{name}.mp3", f"{name} [{video_id}].mp3"):
+        target = os.path.join(folder, candidate)
+        if not os.path.lexists(target):
+            link_file(source, target)
+            return target
+        if same_file(source, target):
+            return target
+    # Our own earlier file for this video, e.g. converted with other settings
+    os.remove(target)
+    link_file(source, target)
+    return target
@@ -0,0 +1,60 @@
+import re
+import json
+
+# EBU R128 target: -16 LUFS integrated, like most streaming services
+LOUDNORM_TARGET = {'I': -16.0, 'TP': -1.5, 'LRA': 11.0}
+COVER_NAME = '.cover'
+
+
+def id3_tags(info, index=None):
+    # ID3 fields from a yt-dlp info dict, only those we know
+    tags = {
+        'title': info.get('track') or info.get('title'),
+        'artist': info.get('artist') or info.get('creator') or info.get('uploader'),
+        'album': info.get('album') or info.get('playlist_title'),
+        'date': (info.get('release_date') or info.get('upload_date') or '')[:4],
+        'track': info.get('track_number') or info.get('playlist_index') or index,
+        'comment': info.get('webpage_url'),
+    }
+    return {key: str(value) for key, value in tags.items() if value}
+
+
+def loudness_args():
+    target = ':'.join(f'{key}={value}' for key, value in LOUDNORM_TARGET.items())
+    return ['-af', f'loudnorm={target}:print_format=json', '-f', 'null', '-']
+
+
+def parse_loudness(stderr):
+    # loudnorm prints its measurements as the last JSON object on stderr
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', stderr)
+    if not match:
+        raise RuntimeError("ffmpeg did not report loudness")
+    return json.loads(match.group(0))
+
+
+def loudnorm_filter(measured):
+    # Second pass: with the first pass's measurements loudnorm can correct linearly
+    # over the whole file instead of adjusting the gain as it goes
+    target = ':'.join(f'{key}={value}' for key, value in LOUDNORM_TARGET.items())
+    return (f"loudnorm={target}:measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true")
+
+
+def image_codec(path):
+    # ID3 covers can be JPEG or PNG, anything else (e.g. YouTube's WebP) is converted to JPEG
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    return 'copy' if magic.startswith(b'\xff\xd8') or magic.startswith(b'\x89PNG') else 'mjpeg'
+
+
+def tag_args(tags, cover=None):
+    # ffmpeg arguments after the inputs: which streams to keep and the ID3v2.3 tags
+    args = ['-map', '0:a:0']
+    if cover:
+        args += ['-map', '1:v:0', '-c:v', image_codec(cover), '-disposition:v', 'attached_pic',
+                 '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)']
+    for key, value in (tags or {}).items():
+        args += ['-metadata', f'{key}={value}']
+    # 2.3 rather than ffmpeg's default 2.4, Windows Explorer and many players only read 2.3
+    return args + ['-id3v2_version', '3']
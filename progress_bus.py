@@ -0,0 +1,55 @@
+import queue
+
+
+class ProgressBus:
+    """Hands progress from worker threads to the UI thread.
+
+    Workers ``post`` plain field dicts keyed by job (never touching Tk); the UI
+    calls ``drain`` once per frame and gets one merged dict per key, so a job
+    that reported 200 times since the last frame is redrawn once.
+    """
+
+    def __init__(self):
+        self._events = queue.SimpleQueue()
+
+    def post(self, key, **fields):
+        self._events.put((key, fields))
+
+    def drain(self):
+        latest = {}
+        while True:
+            try:
+                key, fields = self._events.get_nowait()
+            except queue.Empty:
+                return latest
+            merged = latest.get(key)
+            if merged is None:
+                latest[key] = fields
+            else:
+                merged.update(fields)
+
+
+def job_fields(job):
+    # Snapshot of what the UI needs, numbers only so nothing is parsed per redraw
+    return {
+        'state': job.state,
+        'title': job.title,
+        'progress': job.progress,
+        'downloaded_bytes': job.downloaded_bytes,
+        'total_bytes': job.total_bytes,
+        'speed': job.speed,
+        'eta': job.eta,
+        'status_text': job.status_text,
+        'video_id': job.video_id,
+        'result': job.result,
+        'error': job.error,
+    }
+
+
+def format_bytes(count):
+    if count is None:
+        return 'N/A'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if count < 1024 or unit == 'GiB':
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024.0
@@ -0,0 +1,231 @@
+import os
+import time
+import socket
+import threading
+from download_scheduler import DownloadJob
+
+HEARTBEAT_INTERVAL = 10.0  # seconds between heartbeats for the items we are running
+STALE_AFTER = 60.0  # an active item without a heartbeat for this long belongs to a dead process
+
+
+def process_owner(name):
+    # Queue owner name, unique across the processes sharing the queue
+    return f"{socket.gethostname()}:{os.getpid()}:{name}"
+
+
+class QueueRunner:
+    """Downloads the items of a UrlQueue one after another on a background thread.
+
+    Items are claimed in queue order whenever the scheduler has a free worker,
+    so reordering or pausing the queue takes effect for everything not yet
+    started. An item is done when all of its jobs are: it leaves the queue,
+    or on failure is retried after a growing delay up to ``max_attempts``
+    times. ``on_update`` gets every job change (from worker threads);
+    ``on_item(item_id, outcome, jobs)`` gets each item whose jobs have all
+    finished, the outcome being one of the ITEM_* states below;
+    ``on_idle`` gets the scheduler once nothing is left to run. With ``only``
+    just those item ids are run, and ``exit_when_idle`` ends the thread when
+    none of them is waiting any more. Items reserved for ``owner`` (see
+    UrlQueue.add) are run by this runner only.
+    """
+
+    ITEM_DONE = 'done'
+    ITEM_FAILED = 'failed'  # Out of attempts
+    ITEM_RETRYING = 'retrying'  # Failed, back in the queue for another attempt
+    ITEM_CANCELLED = 'cancelled'  # Back in the queue, e.g. after Cancel
+    ITEM_PAUSED = 'paused'
+
+    def __init__(self, engine, queue, on_update=None, on_idle=None, only=None,
+                 max_attempts=3, backoff=10.0, exit_when_idle=False, on_item=None, owner=None):
+        self.engine = engine
+        self.queue = queue
+        self.on_update = on_update
+        self.on_idle = on_idle
+        self.on_item = on_item
+        self.only = None if only is None else set(only)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.exit_when_idle = exit_when_idle
+        self.owner = owner or process_owner(id(self))
+        self.scheduler = None
+        self.paused = False
+        self.failed = []  # ids of items given up on
+        self._jobs = {}  # active item id -> {job id: job}
+        self._paused_items = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_heartbeat = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='queue-runner', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def heartbeat(self):
+        # Also sent from job updates, listing a long playlist can keep the loop busy for minutes
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_heartbeat < HEARTBEAT_INTERVAL:
+                return False
+            self._last_heartbeat = now
+        self.queue.heartbeat(self.owner)
+        return True
+
+    def run(self):
+        while not self._stop.is_set():
+            if self.heartbeat():
+                self.queue.recover(STALE_AFTER)
+            self.finish_items()
+            if self.has_capacity():
+                item = self.queue.claim(self.owner, self.only)
+                if item is not None:
+                    self.start_item(item)
+                    continue
+            with self._lock:
+                busy = bool(self._jobs)
+            if not busy:
+                if self.scheduler is not None and not self.scheduler.active:
+                    scheduler, self.scheduler = self.scheduler, None
+                    scheduler.wait(timeout=0)  # Frees its worker threads
+                    if self.on_idle:
+                        self.on_idle(scheduler)
+                if self.exit_when_idle and not self.queue.waiting(self.only)[0]:
+                    # What failed for good may be retried from the GUI
+                    self.queue.release(self.owner)
+                    break
+            self._wake.wait(1.0)
+            self._wake.clear()
+
+    def has_capacity(self):
+        # Claim only as much as can run now, the rest stays in the queue where it can still be moved
+        if self.paused:
+            return False
+        scheduler = self.scheduler
+        if scheduler is None:
+            return True
+        if scheduler.cancelled:
+            return False
+        unfinished = sum(not job.finished for job in scheduler.snapshot())
+        return unfinished < scheduler.max_workers
+
+    def start_item(self, item):
+        options = dict(item['options'], queue_item=item['id'])
+        if self.scheduler is None:
+            self.scheduler = self.engine.create_scheduler(options, self._job_changed)
+        with self._lock:
+            self._jobs[item['id']] = {}
+        try:
+            # Pausing the item also stops listing the rest of its playlist
+            info = self.engine.enqueue(self.scheduler, item['url'], options,
+                                       lambda: item['id'] in self._paused_items)
+            if info and info.get('title') and not item['title']:
+                self.queue.set_title(item['id'], info['title'])
+        except Exception as e:
+            self.scheduler.record_failure(item['url'], str(e), options=options)
+
+    def _job_changed(self, job):
+        item_id = (job.options or {}).get('queue_item')
+        with self._lock:
+            jobs = self._jobs.get(item_id)
+            if jobs is not None:
+                jobs[job.id] = job
+            paused = item_id in self._paused_items
+        if paused and not job.finished and not job.cancel_requested:
+            self.scheduler.cancel_job(job)
+        self.heartbeat()
+        if self.on_update:
+            self.on_update(job)
+        if job.finished:
+            self._wake.set()
+
+    def finish_items(self):
+        with self._lock:
+            finished = {item_id: list(jobs.values()) for item_id, jobs in self._jobs.items()
+                        if all(job.finished for job in jobs.values())}
+            for item_id in finished:
+                del self._jobs[item_id]
+        for item_id, jobs in finished.items():
+            failed = [job for job in jobs if job.state == DownloadJob.FAILED]
+            cancelled = any(job.state == DownloadJob.CANCELLED for job in jobs)
+            if item_id in self._paused_items:
+                self._paused_items.discard(item_id)  # Already paused in the queue
+                outcome = QueueRunner.ITEM_PAUSED
+            elif cancelled:
+                self.queue.release(self.owner, item_id)
+                outcome = QueueRunner.ITEM_CANCELLED
+            elif failed:
+                error = failed[0].error or "Download failed"
+                if len(jobs) > 1:
+                    error = f"{len(failed)} of {len(jobs)} failed: {error}"
+                outcome = QueueRunner.ITEM_RETRYING
+                if self.queue.fail(item_id, error, self.max_attempts, self.backoff) == self.queue.FAILED:
+                    self.failed.append(item_id)
+                    outcome = QueueRunner.ITEM_FAILED
+            else:
+                self.queue.finish(item_id)
+                outcome = QueueRunner.ITEM_DONE
+            if self.on_item:
+                try:
+                    self.on_item(item_id, outcome, jobs)
+                except Exception:
+                    pass
+
+    def active_items(self):
+        with self._lock:
+            return set(self._jobs)
+
+    def pause_item(self, item_id):
+        # Stops the item's transfers too, resuming continues from their .part files
+        with self._lock:
+            jobs = list(self._jobs.get(item_id, {}).values())
+            if item_id in self._jobs:
+                self._paused_items.add(item_id)
+        self.queue.pause(item_id)
+        for job in jobs:
+            if not job.finished:
+                self.scheduler.cancel_job(job)
+        self._wake.set()
+
+    def remove_item(self, item_id):
+        self.pause_item(item_id)
+        self.queue.remove(item_id)
+
+    def pause(self):
+        # Running downloads carry on, nothing new is started
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._wake.set()
+
+    def cancel(self):
+        # Stops everything in flight, those items go back to the queue for later
+        self.paused = True
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self.cancel()
+        if self.scheduler is not None:
+            self.scheduler.wait(timeout)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.queue.release(self.owner)
+
+    def join(self, timeout=None):
+        # In small steps, a plain join can't be interrupted by Ctrl+C on Windows
+        while self._thread.is_alive():
+            self._thread.join(0.5 if timeout is None else min(0.5, timeout))
+            if timeout is not None:
+                timeout -= 0.5
+                if timeout <= 0:
+                    break
+        return not self._thread.is_alive()
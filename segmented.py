@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import mmap
+import time
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http_pool import HTTPConnectionPool
+from throttle import Throttle, Cancelled, THROTTLE_STATUSES, retry_after
+
+DEFAULT_CHUNK_SIZE = 10 * 1024 * 1024
+READ_SIZE = 256 * 1024
+
+
+class RangeNotSupported(Exception):
+    # The server ignores Range or doesn't report a length, fetch the stream in one piece instead
+    pass
+
+
+class LinkExpired(Exception):
+    # The server refused the stream link of this video only, its info has to be extracted again
+    pass
+
+
+def content_range(response):
+    # (first byte, total size) from "Content-Range: bytes 0-0/12345"
+    match = re.match(r'bytes (\d+)-\d+/(\d+)', response.getheader('Content-Range') or '')
+    return (int(match.group(1)), int(match.group(2))) if match else (None, None)
+
+
+class SegmentedDownload:
+    """Fetches one stream as concurrent HTTP range requests.
+
+    The file is split into ``chunk_size`` pieces that ``segments`` workers
+    request over pooled keep-alive connections. Each response is read
+    straight into a memory map of the preallocated output (or written at its
+    offset where the file can't be mapped), so pieces land in place whatever
+    order they arrive in. Finished pieces are listed next to the partial file
+    and skipped when the same download is started again.
+
+    ``progress(downloaded, total, speed, eta)`` is called on the calling
+    thread a few times a second; an exception from it stops all workers and
+    is re-raised, which is how a cancel gets in.
+
+    Requests and bytes go through ``throttle``; a 429 or 403 for a range is
+    reported to it and the range tried again once its backoff is over. A 403
+    the throttle puts down to ``source`` alone raises LinkExpired.
+    """
+
+    def __init__(self, segments=4, chunk_size=DEFAULT_CHUNK_SIZE, pool=None, retries=3, throttle=None,
+                 source=None):
+        self.segments = max(1, segments)
+        self.chunk_size = max(READ_SIZE, chunk_size)
+        self.pool = pool or HTTPConnectionPool(max_idle_per_host=self.segments, timeout=20)
+        self.throttle = throttle or Throttle()
+        self.retries = retries
+        self.source = source  # The video, for telling an expired link from throttling
+        self.retried = 0  # Requests that had to be repeated, for the job metrics
+
+    def probe(self, url, headers=None):
+        # A refused probe says nothing about range support, it is sent again after the backoff
+        for attempt in range(self.retries + 1):
+            requested_at = self.throttle.before_request()
+            response, release = self.pool.open(url, dict(headers or {}, Range='bytes=0-0'))
+            # Some servers send everything from the start anyway, only keep the connection if they didn't
+            if (response.length or 0) <= 1:
+                response.read()
+            release()
+            if not self.check_throttled(response, requested_at):
+                raise LinkExpired(f"HTTP {response.status} for {self.source or 'this video'}")
+            if response.status not in THROTTLE_STATUSES:
+                break
+            if attempt == self.retries:
+                raise http.client.HTTPException(f"HTTP {response.status} for a range request")
+            self.retried += 1
+        first, size = content_range(response)
+        if response.status != 206 or first != 0 or not size:
+            raise RangeNotSupported(f"HTTP {response.status} without a usable Content-Range")
+        return size
+
+    def download(self, url, path, headers=None, size=None, progress=None):
+        size = size or self.probe(url, headers)
+        temp = path + '.segments.part'
+        state_path = path + '.segments.json'
+        chunks = [(start, min(start + self.chunk_size, size))
+                  for start in range(0, size, self.chunk_size)]
+        done = self.load_state(temp, state_path, size)
+
+        # Sparse preallocation, pieces are written where they belong
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(temp, 'r+b' if done else 'wb') as f:
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(size)
+        with open(temp, 'r+b') as f:
+            try:
+                view = mmap.mmap(f.fileno(), size)
+            except (OSError, ValueError, OverflowError):
+                view = None  # e.g. 32-bit address space, write through the file instead
+            try:
+                self.fetch_all(url, headers, f, view, chunks, done, size, progress, state_path)
+            finally:
+                if view is not None:
+                    view.close()
+
+        os.replace(temp, path)
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+        return path
+
+    def load_state(self, temp, state_path, size):
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        # Only valid for the same file split the same way
+        if (state.get('size') != size or state.get('chunk_size') != self.chunk_size
+                or not os.path.exists(temp)):
+            return set()
+        return set(state.get('done', []))
+
+    def save_state(self, state_path, size, done):
+        temp = state_path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'size': size, 'chunk_size': self.chunk_size, 'done': sorted(done)}, f)
+        os.replace(temp, state_path)
+
+    def fetch_all(self, url, headers, f, view, chunks, done, size, progress, state_path):
+        pending = [index for index in range(len(chunks)) if index not in done]
+        received = [sum(chunks[index][1] - chunks[index][0] for index in done)]
+        resumed = received[0]
+        lock = threading.Lock()
+        stop = threading.Event()
+        file_lock = threading.Lock()
+
+        def worker():
+            while not stop.is_set():
+                with lock:
+                    if not pending:
+                        return
+                    index = pending.pop(0)
+                if self.fetch_chunk(url, headers, f, view, file_lock, chunks[index], stop,
+                                    received, lock):
+                    with lock:
+                        done.add(index)
+
+        started = time.monotonic()
+        last_saved = started
+        executor = ThreadPoolExecutor(max_workers=min(self.segments, len(pending) or 1),
+                                      thread_name_prefix='segment')
+        futures = [executor.submit(worker) for _ in range(min(self.segments, len(pending)))]
+        try:
+            while True:
+                finished = all(future.done() for future in futures)
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                now = time.monotonic()
+                if progress:
+                    elapsed = now - started
+                    speed = (received[0] - resumed) / elapsed if elapsed > 0 else None
+                    eta = (size - received[0]) / speed if speed else None
+                    progress(received[0], size, speed, eta)
+                if finished:
+                    break
+                if now - last_saved >= 1.0:
+                    with lock:
+                        self.save_state(state_path, size, done)
+                    last_saved = now
+                time.sleep(0.2)
+        except BaseException:
+            stop.set()
+            executor.shutdown(wait=True)
+            with lock:
+                self.save_state(state_path, size, done)
+            raise
+        executor.shutdown(wait=True)
+        if view is not None:
+            view.flush()
+
+    def check_throttled(self, response, requested_at):
+        # False for a 403 that is about this video only
+        if response.status == 403 and not self.throttle.refused(self.source):
+            return False
+        if response.status in THROTTLE_STATUSES:
+            self.throttle.throttled(response.status, requested_at, retry_after(response.headers))
+        else:
+            self.throttle.succeeded()
+        return True
+
+    def fetch_chunk(self, url, headers, f, view, file_lock, chunk, stop, received, lock):
+        # Returns False if stopped before the chunk was complete
+        start, end = chunk
+        for attempt in range(self.retries + 1):
+            position = start
+            try:
+                requested_at = self.throttle.before_request(stop.is_set)
+            except Cancelled:
+                return False
+            try:
+                response, release = self.pool.open(url, dict(headers or {},
+                                                              Range=f'bytes={start}-{end - 1}'))
+                usable = self.check_throttled(response, requested_at)
+                # Straight from the socket into the mapped file, no intermediate copy
+                target = memoryview(view) if view is not None else memoryview(bytearray(READ_SIZE))
+                try:
+                    if not usable:
+                        raise LinkExpired(f"HTTP {response.status} for {self.source or 'this video'}")
+                    if response.status in THROTTLE_STATUSES:
+                        raise http.client.HTTPException(f"HTTP {response.status} for a range request")
+                    if response.status != 206 or content_range(response)[0] != start:
+                        raise RangeNotSupported(f"HTTP {response.status} for a range request")
+                    while position < end:
+                        if stop.is_set():
+                            return False
+                        count = min(READ_SIZE, end - position)
+                        if view is not None:
+                            read = response.readinto(target[position:position + count])
+                        else:
+                            read = response.readinto(target[:count])
+                            with file_lock:
+                                f.seek(position)
+                                f.write(target[:read])
+                        if not read:
+                            raise http.client.IncompleteRead(b'', end - position)
+                        position += read
+                        with lock:
+                            received[0] += read
+                        try:
+                            self.throttle.transferred(read, stop.is_set)
+                        except Cancelled:
+                            return False
+                finally:
+                    target.release()
+                    release()
+                return True
+            except (http.client.HTTPException, OSError):
+                # Bytes of the failed attempt are fetched again, don't count them twice
+                with lock:
+                    received[0] -= position - start
+                    self.retried += 1
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 8))
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from download_archive import DownloadArchive
+from history_view import HistoryStore
+
+
+class PagingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'archive.db')
+        self.archive = DownloadArchive(self.path)
+        self.addCleanup(self.archive.close)
+        # Added within the same second, so only the id keeps the order
+        for number in range(25):
+            self.archive.add(f'video{number:02}', 192, title=f'Video {number}')
+
+    def test_pages_follow_on_without_an_offset(self):
+        first = self.archive.recent(10)
+        second = self.archive.recent(10, before=(first[-1]['downloaded_at'], first[-1]['id']))
+        self.assertEqual([row['video_id'] for row in first + second],
+                         [f'video{number:02}' for number in range(24, 4, -1)])
+
+    def test_history_store_reads_the_next_block_by_cursor(self):
+        store = HistoryStore(self.archive, block_size=10, max_blocks=2)
+        with mock.patch.object(self.archive, 'recent', wraps=self.archive.recent) as recent:
+            records = store.rows(0, 25)
+        self.assertEqual([record.video_id for record in records],
+                         [f'video{number:02}' for number in range(24, -1, -1)])
+        self.assertTrue(all(call.kwargs.get('before') for call in recent.call_args_list[1:]))
+        self.assertTrue(all(len(call.args) == 1 for call in recent.call_args_list))
+
+    def test_count_is_cached_until_the_archive_changes(self):
+        self.assertEqual(self.archive.count(), 25)
+        statements = []
+        self.archive._conn.set_trace_callback(statements.append)
+        self.archive.add('video99', 192)
+        self.archive.add('video00', 192)
+        self.archive.remove('video01', 192)
+        self.assertEqual(self.archive.count(), 25)
+        self.assertEqual(self.archive.count(search='Video 3'), 1)
+        self.archive._conn.set_trace_callback(None)
+        # Only the filtered count had to be read again
+        self.assertEqual(sum('COUNT(*)' in statement for statement in statements), 1)
+
+        other = DownloadArchive(self.path)
+        self.addCleanup(other.close)
+        other.add('video98', 192)
+        self.assertEqual(self.archive.count(), 26)
+
+
+if __name__ == '__main__':
+    unittest.main()
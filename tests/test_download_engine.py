@@ -0,0 +1,107 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from fake_server import FakeMediaServer, fake_extractors
+from download_engine import DownloadEngine, default_options
+from download_scheduler import DownloadJob
+from yt_dlp.utils import ExtractorError
+
+
+class RenamingTranscoder:
+    # Stands in for ffmpeg: the download becomes the MP3 once ``ready`` is set
+    def __init__(self):
+        self.ready = threading.Event()
+
+    def submit(self, source, quality, timings=None, copy=False, tags=None, cover=None, normalize=False):
+        self.ready.wait(10)
+        target = os.path.splitext(source)[0] + '.mp3'
+        os.replace(source, target)
+        future = Future()
+        future.set_result(target)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class LateClaimEngine(DownloadEngine):
+    # The second job claims the store only after the first has released it, so its
+    # conversion must be found by looking again once the claim is held
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.claims = 0
+
+    def claim_store(self, options, video_id):
+        self.claims += 1
+        if self.claims > 1:
+            self.transcoder.ready.set()
+            for _ in range(200):
+                if not self._converting:
+                    break
+                threading.Event().wait(0.05)
+        return super().claim_store(options, video_id)
+
+
+def private_extractors(server):
+    video, playlist = fake_extractors(server)
+
+    class PrivateVideoIE(video):
+        def _real_extract(self, url):
+            raise ExtractorError("Private video. Sign in if you've been granted access", expected=True)
+
+    return [PrivateVideoIE, playlist]
+
+
+class ExtractionErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server = FakeMediaServer(seconds=2).start()
+        self.addCleanup(self.server.stop)
+        self.engine = DownloadEngine(transcoder=RenamingTranscoder(), extractors=private_extractors(self.server))
+        self.addCleanup(self.engine.shutdown)
+
+    def test_extract_info_keeps_the_reason(self):
+        with self.assertRaisesRegex(Exception, 'Private video'):
+            self.engine.extract_info('benchvideo:hidden', default_options(self.directory))
+
+    def test_failed_job_keeps_the_reason(self):
+        scheduler = self.engine.run(['benchvideo:hidden'], default_options(self.directory))
+        [job] = scheduler.jobs
+        self.assertEqual(job.state, DownloadJob.FAILED)
+        self.assertIn('Private video', job.error)
+
+
+class SameVideoTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server = FakeMediaServer(seconds=2).start()
+        self.addCleanup(self.server.stop)
+
+    def test_second_job_links_the_first_jobs_file(self):
+        engine = LateClaimEngine(transcoder=RenamingTranscoder(), extractors=fake_extractors(self.server))
+        self.addCleanup(engine.shutdown)
+        options = dict(default_options(self.directory), tags=False, concurrency=2)
+        scheduler = engine.create_scheduler(options)
+        for folder in ('first', 'second'):
+            scheduler.submit('benchvideo:same', options=dict(options, folder=folder))
+        scheduler.wait()
+
+        states = sorted(job.state for job in scheduler.jobs)
+        self.assertEqual(states, [DownloadJob.DONE, DownloadJob.SKIPPED])
+        self.assertEqual(self.server.requests, 1)
+        first, second = (os.stat(job.result) for job in scheduler.jobs)
+        self.assertEqual((first.st_dev, first.st_ino), (second.st_dev, second.st_ino))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from format_planner import plan_format
+
+
+def audio(format_id, acodec, abr, filesize, **fields):
+    return dict(format_id=format_id, acodec=acodec, vcodec='none', abr=abr, filesize=filesize, **fields)
+
+
+class PlanFormatTest(unittest.TestCase):
+    def test_smallest_good_enough(self):
+        info = {'duration': 60, 'formats': [
+            audio('139', 'mp4a.40.5', 48, 400000),
+            audio('140', 'mp4a.40.2', 128, 1000000),
+            audio('251', 'opus', 140, 1100000),
+        ]}
+        plan = plan_format(info, '128')
+        self.assertEqual(plan.format_id, '140')
+        self.assertFalse(plan.copy)
+        self.assertEqual(plan.bytes_saved, 100000)
+
+    def test_skips_dubbed_and_drc_tracks(self):
+        # The dubbed and DRC formats are the smallest that would do, the original track must win
+        info = {'duration': 60, 'formats': [
+            audio('251-1', 'opus', 130, 900000, language='de', language_preference=-1,
+                  format_note='German, medium'),
+            audio('251-drc', 'opus', 130, 950000, language='en', language_preference=10,
+                  format_note='English original (default), medium, DRC'),
+            audio('140', 'mp4a.40.2', 128, 1000000, language='en', language_preference=10,
+                  format_note='English original (default), medium'),
+            audio('251', 'opus', 135, 1050000, language='en', language_preference=10,
+                  format_note='English original (default), medium'),
+        ]}
+        plan = plan_format(info, '128')
+        self.assertEqual(plan.format_id, '140')
+
+    def test_only_drc_formats(self):
+        info = {'duration': 60, 'formats': [audio('251-drc', 'opus', 130, 950000)]}
+        self.assertEqual(plan_format(info, '192').format_id, '251-drc')
+
+
+if __name__ == '__main__':
+    unittest.main()
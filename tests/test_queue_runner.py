@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_server import FakeMediaServer, fake_extractors
+from download_engine import DownloadEngine, default_options
+from queue_runner import QueueRunner
+from url_queue import UrlQueue
+from test_download_engine import RenamingTranscoder
+
+
+class PauseItemTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server = FakeMediaServer(seconds=1).start()
+        self.addCleanup(self.server.stop)
+
+    def test_pausing_a_playlist_stops_its_listing(self):
+        transcoder = RenamingTranscoder()
+        transcoder.ready.set()
+        engine = DownloadEngine(transcoder=transcoder, extractors=fake_extractors(self.server))
+        self.addCleanup(engine.shutdown)
+        queue = UrlQueue(os.path.join(self.directory, 'queue.db'))
+        options = dict(default_options(self.directory), playlist=True, tags=False, concurrency=1)
+        item_id = queue.add('benchplaylist:50', options)
+        jobs = set()
+        outcomes = []
+        finished = threading.Event()
+
+        def job_changed(job):
+            jobs.add(job.id)
+            if len(jobs) == 1 and not job.finished:
+                runner.pause_item(item_id)
+
+        def item_finished(finished_id, outcome, item_jobs):
+            outcomes.append(outcome)
+            finished.set()
+
+        runner = QueueRunner(engine, queue, on_update=job_changed, on_item=item_finished)
+        runner.start()
+        self.addCleanup(runner.stop)
+        self.assertTrue(finished.wait(30))
+
+        self.assertEqual(outcomes, [QueueRunner.ITEM_PAUSED])
+        self.assertEqual(queue.get(item_id)['state'], UrlQueue.PAUSED)
+        # The jobs already submitted when the pause came, not one per playlist entry
+        self.assertLessEqual(len(jobs), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
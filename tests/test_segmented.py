@@ -0,0 +1,69 @@
+import os
+import sys
+import shutil
+import tempfile
+import itertools
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from fake_server import FakeMediaServer
+from segmented import SegmentedDownload
+from throttle import Throttle
+
+
+class RefusingServer(FakeMediaServer):
+    # Answers the first ``refuse`` requests with 429
+    def __init__(self, refuse, **kwargs):
+        super().__init__(**kwargs)
+        self.refuse = refuse
+        self.statuses = []
+
+    def _handler(self):
+        base = super()._handler()
+        media = self
+        count = itertools.count()
+
+        class Handler(base):
+            def respond(self, head=False):
+                if next(count) < media.refuse:
+                    media.statuses.append(429)
+                    self.send_response(429)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                media.statuses.append(206 if self.headers.get('Range') else 200)
+                super().respond(head)
+
+        return Handler
+
+
+class ProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_probe_refused_with_429_is_retried(self):
+        server = RefusingServer(1, seconds=2).start()
+        self.addCleanup(server.stop)
+        events = []
+        throttle = Throttle(on_event=lambda event, fields: events.append(event))
+        downloader = SegmentedDownload(4, 64 * 1024, throttle=throttle)
+        path = os.path.join(self.directory, 'a.wav')
+        with mock.patch('throttle.MIN_BACKOFF', 0.05):
+            downloader.download(f'{server.base_url}/audio/a.wav', path)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), server.body)
+        # Still fetched in ranges, not as one stream
+        self.assertEqual(server.statuses[0], 429)
+        self.assertNotIn(200, server.statuses)
+        self.assertGreater(server.statuses.count(206), 1)
+        self.assertEqual(downloader.retried, 1)
+        self.assertIn('backoff', events)
+
+
+if __name__ == '__main__':
+    unittest.main()
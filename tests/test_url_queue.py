@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from url_queue import UrlQueue
+
+
+class ReservedItemTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'queue.db')
+        self.cli = UrlQueue(self.path)
+        self.gui = UrlQueue(self.path)
+        self.addCleanup(self.cli.close)
+        self.addCleanup(self.gui.close)
+
+    def test_only_the_reserving_owner_claims(self):
+        mine = self.cli.add('https://example.com/a', {}, reserved='cli')
+        shared = self.cli.add('https://example.com/b', {})
+        self.assertEqual(self.gui.claim('gui')['id'], shared)
+        self.assertIsNone(self.gui.claim('gui'))
+        self.assertEqual(self.cli.claim('cli')['id'], mine)
+
+    def test_shutdown_hands_reserved_items_back(self):
+        item_id = self.cli.add('https://example.com/a', {}, reserved='cli')
+        self.cli.release('cli')
+        self.assertEqual(self.gui.claim('gui')['id'], item_id)
+
+    def test_reservation_of_a_dead_process_lapses(self):
+        item_id = self.cli.add('https://example.com/a', {}, reserved='cli')
+        self.gui.recover(stale_after=60)
+        self.assertIsNone(self.gui.claim('gui'))
+        self.cli.heartbeat('cli')
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("UPDATE queue SET updated_at = ?", (time.time() - 120,))
+        self.gui.recover(stale_after=60)
+        self.assertEqual(self.gui.claim('gui')['id'], item_id)
+
+    def test_queue_without_reservations_is_upgraded(self):
+        path = os.path.join(self.directory, 'old.db')
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE queue (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, "
+                         "title TEXT, options TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+                         "position REAL NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                         "next_attempt_at REAL NOT NULL DEFAULT 0, error TEXT, owner TEXT, "
+                         "updated_at REAL NOT NULL)")
+            conn.execute("INSERT INTO queue (url, options, position, state, updated_at) "
+                         "VALUES ('https://example.com/a', '{}', 1, 'pending', 0)")
+        conn.close()
+        queue = UrlQueue(path)
+        self.addCleanup(queue.close)
+        self.assertEqual(queue.claim('gui')['url'], 'https://example.com/a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import json
+import time
+import weakref
+import threading
+
+THROTTLE_STATUSES = (403, 429)
+MIN_BACKOFF = 5.0  # seconds, first pause after the server pushes back
+MAX_BACKOFF = 300.0
+RECOVER_AFTER = 60.0  # seconds without push-back before concurrency goes up again
+REFUSED_WINDOW = 120.0  # seconds, 403s for different videos within it count as throttling
+WAIT_SLICE = 0.25  # waits are sliced so a cancel gets through
+
+
+class Cancelled(Exception):
+    # A wait was given up because its job was cancelled
+    pass
+
+
+def throttle_status(error):
+    # 429 or 403 from a yt-dlp HTTPError, None for anything else
+    status = getattr(error, 'status', None)
+    return status if status in THROTTLE_STATUSES else None
+
+
+def retry_after(headers):
+    # Seconds from a Retry-After header, if the server sent one in seconds
+    try:
+        return float(headers.get('Retry-After')) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def sleep_until(deadline, cancelled=None):
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if cancelled is not None and cancelled():
+            raise Cancelled()
+        time.sleep(min(remaining, WAIT_SLICE))
+
+
+class TokenBucket:
+    """Hands out ``rate`` units per second to all threads together.
+
+    Up to ``burst`` units (a second's worth by default) can be taken at once
+    after a quiet spell; beyond that ``consume`` sleeps until the units have
+    been earned. A rate of 0 or None means unlimited.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate or None
+            self.burst = burst or self.rate or 0
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+
+    def consume(self, amount=1, cancelled=None):
+        # Takes the units now and sleeps off any debt, returns the seconds slept
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        sleep_until(time.monotonic() + delay, cancelled)
+        return delay
+
+
+class Throttle:
+    """Global limits shared by every download worker, and the reaction to
+    servers that push back.
+
+    ``bandwidth`` (bytes/s) and ``requests_per_minute`` cap all transfers and
+    HTTP requests together. A 429, or 403s for different videos, pause new
+    requests from all workers for a backoff that doubles while the errors continue (or what Retry-After
+    asks for), and halves the concurrency of attached schedulers; after
+    ``RECOVER_AFTER`` seconds without errors one more worker is allowed at a
+    time. Every such decision goes to ``on_event(event, fields)`` and, with
+    a ``log_path``, is appended there as a JSON line.
+    """
+
+    def __init__(self, bandwidth=None, requests_per_minute=None, log_path=None, on_event=None):
+        self.bandwidth = TokenBucket()
+        self.requests = TokenBucket()
+        self.log_path = log_path
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._schedulers = weakref.WeakSet()
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self.backoff_started = None
+        self.last_change = 0.0
+        self.limit = None  # Reduced concurrency, None while not throttled
+        self._refused = {}  # Video -> time of its last 403
+        self.configure(bandwidth, requests_per_minute)
+
+    def configure(self, bandwidth=None, requests_per_minute=None):
+        bandwidth = bandwidth or None
+        requests_per_minute = requests_per_minute or None
+        if (bandwidth, requests_per_minute) == (self.bandwidth.rate,
+                                                self.requests.rate and self.requests.rate * 60):
+            return
+        self.bandwidth.set_rate(bandwidth)
+        # A few requests may go out together, e.g. the pages of a playlist listing
+        self.requests.set_rate(requests_per_minute / 60.0 if requests_per_minute else None,
+                               max(1, (requests_per_minute or 0) // 20))
+        self.log('limits', bandwidth=bandwidth, requests_per_minute=requests_per_minute)
+
+    def attach(self, scheduler):
+        self._schedulers.add(scheduler)
+        if self.limit is not None:
+            scheduler.set_limit(self.limit)
+
+    def log(self, event, **fields):
+        if self.on_event:
+            try:
+                self.on_event(event, fields)
+            except Exception:
+                pass
+        if self.log_path:
+            record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'event': event}
+            record.update(fields)
+            try:
+                with self._lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + '\n')
+            except OSError:
+                pass
+
+    def before_request(self, cancelled=None):
+        # Waits out a backoff and the request rate, returns when the request may be sent
+        started = time.monotonic()
+        sleep_until(self.paused_until, cancelled)
+        self.requests.consume(1, cancelled)
+        waited = time.monotonic() - started
+        if waited >= 1.0:
+            self.log('request_delayed', seconds=round(waited, 2))
+        return started
+
+    def transferred(self, amount, cancelled=None):
+        if amount > 0:
+            self.bandwidth.consume(amount, cancelled)
+
+    def refused(self, source):
+        # A 403 for one video is usually its stream link expiring, only when other
+        # videos get one too is the server refusing us
+        now = time.monotonic()
+        with self._lock:
+            self._refused = {key: at for key, at in self._refused.items() if now - at < REFUSED_WINDOW}
+            blocked = any(key != source for key in self._refused)
+            self._refused[source] = now
+        if not blocked:
+            self.log('refused', video=source)
+        return blocked
+
+    def throttled(self, status, requested_at=None, retry_after=None):
+        # Requests sent before the last backoff started are part of the same burst
+        now = time.monotonic()
+        with self._lock:
+            if requested_at is not None and self.backoff_started is not None \
+                    and requested_at < self.backoff_started:
+                return False
+            self.backoff = min(MAX_BACKOFF, max(MIN_BACKOFF, self.backoff * 2))
+            pause = max(self.backoff, retry_after or 0)
+            self.paused_until = now + pause
+            self.backoff_started = self.last_change = now
+            schedulers = list(self._schedulers)
+            current = self.limit or max([scheduler.max_workers for scheduler in schedulers] or [1])
+            self.limit = max(1, current // 2)
+        for scheduler in schedulers:
+            scheduler.set_limit(self.limit)
+        self.log('backoff', status=status, seconds=round(pause, 1), concurrency=self.limit)
+        return True
+
+    def succeeded(self):
+        # Additive recovery: one more worker per quiet RECOVER_AFTER seconds
+        if self.limit is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.limit is None or now - self.last_change < RECOVER_AFTER:
+                return
+            schedulers = list(self._schedulers)
+            maximum = max([scheduler.max_workers for scheduler in schedulers] or [1])
+            self.last_change = now
+            self.backoff /= 2
+            self.limit = None if self.limit + 1 >= maximum else self.limit + 1
+            limit = self.limit or maximum
+        for scheduler in schedulers:
+            scheduler.set_limit(limit)
+        self.log('recover', concurrency=limit)
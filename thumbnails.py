@@ -0,0 +1,71 @@
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from http_pool import HTTPConnectionPool
+
+THUMBNAIL_SIZE = (120, 68)
+
+
+def fetch_thumbnail(url, cache=None, pool=None):
+    # The image as served, cached so the preview and the MP3's cover art share one download
+    key = f"original|{url}"
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        data = (pool or HTTPConnectionPool()).get(url)
+        if cache is not None:
+            cache.put(key, data)
+    return data
+
+
+def decode_thumbnail(data, size=THUMBNAIL_SIZE):
+    from PIL import Image  # Only needed once there is a thumbnail, keeps it out of startup
+    image = Image.open(BytesIO(data))
+    # For JPEGs let the decoder scale down by 1/2..1/8 instead of decoding full size
+    image.draft('RGB', (size[0] * 2, size[1] * 2))
+    image = image.convert('RGB')
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+class ThumbnailLoader:
+    """Fetches, decodes and resizes thumbnails on a worker thread.
+
+    ``request`` returns immediately; ``callback(image)`` runs on the worker
+    with a ready-to-show PIL image (or None on failure). Only turning that
+    into a PhotoImage is left for the Tk main thread.
+    """
+
+    def __init__(self, cache=None, size=THUMBNAIL_SIZE, pool=None):
+        self.cache = cache
+        self.size = size
+        self.pool = pool or HTTPConnectionPool()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnail')
+
+    def load(self, url):
+        key = f"{self.size[0]}x{self.size[1]}|{url}"
+        if self.cache is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                from PIL import Image
+                image = Image.open(BytesIO(data))
+                image.load()
+                return image
+
+        image = decode_thumbnail(fetch_thumbnail(url, self.cache, self.pool), self.size)
+        if self.cache is not None:
+            # Keep the resized image so the next preview skips download and resize
+            buffer = BytesIO()
+            image.save(buffer, format='PNG')
+            self.cache.put(key, buffer.getvalue())
+        return image
+
+    def request(self, url, callback):
+        def run():
+            try:
+                image = self.load(url)
+            except Exception:
+                image = None
+            callback(image)
+        return self._executor.submit(run)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self.pool.close()
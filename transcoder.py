@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import shutil
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from postprocess import loudness_args, parse_loudness, loudnorm_filter, tag_args
+
+
+def find_ffmpeg():
+    # Frozen builds ship ffmpeg.exe next to the bundled code (see build_exe.py)
+    if getattr(sys, 'frozen', False):
+        for folder in (getattr(sys, '_MEIPASS', None), os.path.dirname(sys.executable)):
+            if folder:
+                candidate = os.path.join(folder, 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
+                if os.path.exists(candidate):
+                    return candidate
+    return shutil.which('ffmpeg') or 'ffmpeg'
+
+
+def run_ffmpeg(args, ffmpeg=None, loglevel='error'):
+    cmd = [ffmpeg or find_ffmpeg(), '-y', '-hide_banner', '-nostats', '-loglevel', loglevel] + list(args)
+    # Don't flash a console window per file in the windowed build
+    flags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, creationflags=flags)
+    if result.returncode != 0:
+        error = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise RuntimeError(f"ffmpeg failed: {error[-1] if error else result.returncode}")
+    return result
+
+
+def downloaded_file(ydl, info):
+    # Where yt-dlp actually wrote the file, falling back to the template path
+    for download in info.get('requested_downloads') or []:
+        if download.get('filepath'):
+            return download['filepath']
+    return info.get('filepath') or ydl.prepare_filename(info)
+
+
+def measure_loudness(source, ffmpeg=None):
+    # First loudnorm pass, analysis only
+    result = run_ffmpeg(['-i', source, '-vn'] + loudness_args(), ffmpeg, loglevel='info')
+    return parse_loudness(result.stderr.decode('utf-8', 'replace'))
+
+
+def transcode_to_mp3(source, quality, ffmpeg=None, keep_source=False, timings=None, copy=False,
+                     tags=None, cover=None, normalize=False):
+    # timings, if given, gets the seconds spent in ffmpeg and in moving files into place.
+    # copy takes MP3 audio out of its container as is instead of encoding it again.
+    # tags and cover (an image file, removed afterwards) are written as ID3 in the same pass;
+    # normalize measures the loudness first and encodes with a two-pass loudnorm.
+    target = os.path.splitext(source)[0] + '.mp3'
+    temp = target + '.part'
+    started = time.perf_counter()
+    audio_filter = []
+    if normalize:
+        audio_filter = ['-af', loudnorm_filter(measure_loudness(source, ffmpeg))]
+        copy = False  # Changing the level means encoding again
+    measured = time.perf_counter()
+    codec = ['-codec:a', 'copy'] if copy else ['-codec:a', 'libmp3lame', '-b:a', f'{quality}k']
+    output = audio_filter + codec + ['-f', 'mp3', temp]
+    try:
+        if tags is None and cover is None:
+            run_ffmpeg(['-i', source, '-vn'] + output, ffmpeg)
+        elif cover:
+            try:
+                run_ffmpeg(['-i', source, '-i', cover] + tag_args(tags, cover) + output, ffmpeg)
+            except RuntimeError:
+                # An image ffmpeg can't read shouldn't cost the whole file
+                run_ffmpeg(['-i', source] + tag_args(tags) + output, ffmpeg)
+        else:
+            run_ffmpeg(['-i', source] + tag_args(tags) + output, ffmpeg)
+    finally:
+        if cover and os.path.exists(cover):
+            os.remove(cover)
+    encoded = time.perf_counter()
+    os.replace(temp, target)
+    if not keep_source and os.path.abspath(source) != os.path.abspath(target):
+        os.remove(source)
+    if timings is not None:
+        if normalize:
+            timings['loudness'] = measured - started
+        timings['ffmpeg'] = encoded - measured
+        timings['finalize'] = time.perf_counter() - encoded
+    return target
+
+
+def timed_transcode(source, quality, ffmpeg=None, copy=False, tags=None, cover=None, normalize=False):
+    # Pool entry point, timings can't be filled in across the process boundary
+    timings = {}
+    return transcode_to_mp3(source, quality, ffmpeg, timings=timings, copy=copy, tags=tags,
+                            cover=cover, normalize=normalize), timings
+
+
+class TranscodePool:
+    """CPU-bound MP3 encoding stage, one ffmpeg per core.
+
+    Download workers hand finished audio files to ``submit`` and move on to
+    the next entry, so network transfer and encoding overlap. Tagging and
+    loudness normalization run here too, as part of the same job.
+    """
+
+    def __init__(self, max_workers=None, ffmpeg=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ffmpeg = ffmpeg or find_ffmpeg()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, source, quality, timings=None, copy=False, tags=None, cover=None, normalize=False):
+        # Returns a Future of the MP3 path. timings, if given, is filled in before it
+        # completes: ffmpeg and finalize from the worker, convert_wait for the rest.
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork, the parent has Tk and download threads running
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            submitted = time.perf_counter()
+            inner = self._executor.submit(timed_transcode, source, quality, self.ffmpeg, copy,
+                                          tags, cover, normalize)
+
+        future = Future()
+
+        def done(inner):
+            if inner.cancelled():
+                future.cancel()
+                return
+            error = inner.exception()
+            if error is not None:
+                future.set_exception(error)
+                return
+            target, worker_timings = inner.result()
+            if timings is not None:
+                timings.update(worker_timings)
+                timings['convert_wait'] = max(0.0, time.perf_counter() - submitted
+                                              - sum(worker_timings.values()))
+            future.set_result(target)
+        inner.add_done_callback(done)
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
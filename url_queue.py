@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class UrlQueue:
+    """URLs waiting to be downloaded, stored in SQLite so they survive restarts.
+
+    Items run highest ``priority`` first, then in the order they were added
+    (or moved to). Several processes can share one queue: ``claim`` hands
+    each item to one owner only, and items whose owner stopped sending
+    ``heartbeat`` are given back by ``recover``. An item added with
+    ``reserved`` set is only claimed by that owner, e.g. the URLs a command
+    line run was started with; the reservation ends with its heartbeats.
+    """
+
+    PENDING = 'pending'
+    ACTIVE = 'active'
+    PAUSED = 'paused'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._local_changes = 0
+        self._seen_version = None
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    options TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    position REAL NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    owner TEXT,
+                    reserved TEXT,
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS queue_order ON queue (state, priority DESC, position)")
+            # Queues from before reservations, every item is anyone's
+            columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(queue)")]
+            if 'reserved' not in columns:
+                self._conn.execute("ALTER TABLE queue ADD COLUMN reserved TEXT")
+
+    def _record(self, row):
+        record = dict(row)
+        record['options'] = json.loads(record['options'])
+        return record
+
+    def _write(self, sql, params=()):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(sql, params)
+            self._local_changes += 1
+        return cursor
+
+    def add(self, url, options, priority=0, title=None, reserved=None):
+        now = time.time()
+        with self._lock, self._conn:
+            position = self._conn.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM queue").fetchone()[0]
+            cursor = self._conn.execute(
+                "INSERT INTO queue (url, title, options, priority, position, state, reserved, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, title, json.dumps(options), priority, position, UrlQueue.PENDING, reserved, now))
+            self._local_changes += 1
+        return cursor.lastrowid
+
+    def get(self, item_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM queue WHERE id = ?", (item_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def items(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM queue ORDER BY priority DESC, position").fetchall()
+        return [self._record(row) for row in rows]
+
+    def _only(self, only):
+        if only is None:
+            return "", []
+        ids = list(only)
+        return f" AND id IN ({', '.join('?' * len(ids))})" if ids else " AND 0", ids
+
+    def claim(self, owner, only=None):
+        # The UPDATE only succeeds while the item is still pending, so when two processes
+        # pick the same item one of them gets no row and moves on to the next item
+        where, params = self._only(only)
+        now = time.time()
+        with self._lock, self._conn:
+            while True:
+                row = self._conn.execute(
+                    "SELECT * FROM queue WHERE state = ? AND next_attempt_at <= ? "
+                    "AND (reserved IS NULL OR reserved = ?)" + where +
+                    " ORDER BY priority DESC, position LIMIT 1",
+                    [UrlQueue.PENDING, now, owner] + params).fetchone()
+                if row is None:
+                    return None
+                cursor = self._conn.execute(
+                    "UPDATE queue SET state = ?, owner = ?, updated_at = ? WHERE id = ? AND state = ?",
+                    (UrlQueue.ACTIVE, owner, now, row['id'], UrlQueue.PENDING))
+                if cursor.rowcount == 1:
+                    break
+            self._local_changes += 1
+        record = self._record(row)
+        record['state'] = UrlQueue.ACTIVE
+        return record
+
+    def waiting(self, only=None):
+        # (items that could run now or later, earliest time one of them may start)
+        where, params = self._only(only)
+        with self._lock:
+            count, next_at = self._conn.execute(
+                "SELECT COUNT(*), MIN(next_attempt_at) FROM queue WHERE state = ?" + where,
+                [UrlQueue.PENDING] + params).fetchone()
+        return count, next_at
+
+    def heartbeat(self, owner):
+        self._write("UPDATE queue SET updated_at = ? WHERE owner = ? AND state = ? OR reserved = ?",
+                    (time.time(), owner, UrlQueue.ACTIVE, owner))
+
+    def recover(self, stale_after=300):
+        # Items left active or reserved by a process that crashed or was killed
+        stale = time.time() - stale_after
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE queue SET state = ?, owner = NULL WHERE state = ? AND updated_at < ?",
+                (UrlQueue.PENDING, UrlQueue.ACTIVE, stale))
+            self._conn.execute(
+                "UPDATE queue SET reserved = NULL WHERE reserved IS NOT NULL AND updated_at < ?", (stale,))
+            self._local_changes += 1
+
+    def release(self, owner, item_id=None):
+        # Cancelled or clean shutdown, the items keep their place and run again later.
+        # After a shutdown any process may run them
+        sql = "UPDATE queue SET state = ?, owner = NULL WHERE owner = ? AND state = ?"
+        params = [UrlQueue.PENDING, owner, UrlQueue.ACTIVE]
+        if item_id is not None:
+            sql += " AND id = ?"
+            params.append(item_id)
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+            if item_id is None:
+                self._conn.execute("UPDATE queue SET reserved = NULL WHERE reserved = ?", (owner,))
+            self._local_changes += 1
+
+    def set_title(self, item_id, title):
+        self._write("UPDATE queue SET title = ? WHERE id = ?", (title, item_id))
+
+    def finish(self, item_id):
+        # Finished items live on in the download history, not here
+        self._write("DELETE FROM queue WHERE id = ?", (item_id,))
+
+    def fail(self, item_id, error, max_attempts=3, backoff=10.0, max_backoff=600.0):
+        # Try again later with exponential backoff, give up after max_attempts
+        item = self.get(item_id)
+        if item is None:
+            return None
+        attempts = item['attempts'] + 1
+        if attempts >= max_attempts:
+            state, next_at = UrlQueue.FAILED, 0
+        else:
+            state, next_at = UrlQueue.PENDING, time.time() + min(backoff * 2 ** (attempts - 1), max_backoff)
+        self._write("UPDATE queue SET state = ?, attempts = ?, next_attempt_at = ?, error = ?, "
+                    "owner = NULL, updated_at = ? WHERE id = ? AND state = ?",
+                    (state, attempts, next_at, error, time.time(), item_id, UrlQueue.ACTIVE))
+        return state
+
+    def pause(self, item_id):
+        self._write("UPDATE queue SET state = ?, owner = NULL WHERE id = ? AND state IN (?, ?)",
+                    (UrlQueue.PAUSED, item_id, UrlQueue.PENDING, UrlQueue.ACTIVE))
+
+    def resume(self, item_id=None):
+        if item_id is None:
+            self._write("UPDATE queue SET state = ? WHERE state = ?", (UrlQueue.PENDING, UrlQueue.PAUSED))
+        else:
+            self._write("UPDATE queue SET state = ? WHERE id = ? AND state = ?",
+                        (UrlQueue.PENDING, item_id, UrlQueue.PAUSED))
+
+    def pause_all(self):
+        self._write("UPDATE queue SET state = ? WHERE state = ?", (UrlQueue.PAUSED, UrlQueue.PENDING))
+
+    def retry(self, item_id):
+        # Manual retry starts the attempt count over and skips the wait
+        self._write("UPDATE queue SET state = ?, attempts = 0, next_attempt_at = 0, error = NULL "
+                    "WHERE id = ? AND state IN (?, ?)",
+                    (UrlQueue.PENDING, item_id, UrlQueue.FAILED, UrlQueue.PAUSED))
+
+    def remove(self, item_id):
+        self._write("DELETE FROM queue WHERE id = ? AND state != ?", (item_id, UrlQueue.ACTIVE))
+
+    def set_priority(self, item_id, priority):
+        self._write("UPDATE queue SET priority = ? WHERE id = ?", (priority, item_id))
+
+    def move(self, item_id, offset):
+        # Swap places with the item ``offset`` steps away in run order (negative is earlier)
+        order = [(item['id'], item['priority'], item['position']) for item in self.items()]
+        index = next((i for i, entry in enumerate(order) if entry[0] == item_id), None)
+        if index is None or not 0 <= index + offset < len(order):
+            return False
+        other = order[index + offset]
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE queue SET priority = ?, position = ? WHERE id = ?",
+                               (other[1], other[2], item_id))
+            self._conn.execute("UPDATE queue SET priority = ?, position = ? WHERE id = ?",
+                               (order[index][1], order[index][2], other[0]))
+            self._local_changes += 1
+        return True
+
+    def changed(self):
+        # True if this or another process changed the queue since the last call
+        with self._lock:
+            version = (self._conn.execute("PRAGMA data_version").fetchone()[0], self._local_changes)
+        changed, self._seen_version = version != self._seen_version, version
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def read_drop_file(path):
+    """Takes the URLs out of a drop file, one per line.
+
+    The file is renamed before reading, so lines appended meanwhile by another
+    program end up in a new file for the next call instead of being lost.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+    taken = path + '.reading'
+    try:
+        os.replace(path, taken)
+        with open(taken, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        os.remove(taken)
+    except OSError:
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+def import_unfinished(queue, state_store):
+    # Jobs left over from before the queue existed become queue items; jobs of
+    # queue items are dropped, their item runs again and skips what is done
+    added = 0
+    for record in state_store.unfinished():
+        if 'queue_item' not in record['options']:
+            queue.add(record['url'], record['options'], title=record['title'])
+            added += 1
+    state_store.clear()
+    return added
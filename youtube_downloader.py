@@ -1,21 +1,35 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import yt_dlp
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
+import time
 import sys
 import json
-from urllib.request import urlopen
-from PIL import Image, ImageTk
-from io import BytesIO
-import re
+import multiprocessing
+from download_scheduler import DownloadJob, default_concurrency
+from throttle import Throttle
+from download_engine import DownloadEngine, QUALITIES
+from download_archive import DownloadArchive
+from job_state import JobStateStore
+from info_cache import InfoCache, thumbnail_cache
+from thumbnails import ThumbnailLoader
+from progress_bus import ProgressBus, job_fields, format_bytes
+from history_view import HistoryStore, HistoryView
+from metrics import MetricsRecorder, MetricsServer, STAGES
+from url_queue import UrlQueue, read_drop_file, import_unfinished
+from queue_runner import QueueRunner
+
+FRAME_INTERVAL = 100  # ms between progress redraws
+HISTORY_PERIODS = {'All time': None, 'Today': 0, 'Last 7 days': 7, 'Last 30 days': 30}
+QUEUE_POLL_INTERVAL = 1000  # ms between checks of the drop file and the queue
+DROP_FILE = 'download_queue.txt'  # other programs can append URLs here, one per line
 
 class YouTubeMp3DownloaderGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("YouTube MP3 Downloader")
-        self.root.geometry("800x700")
+        self.root.geometry("800x850")
         
         # Initialize variables
         if getattr(sys, 'frozen', False):
@@ -23,32 +37,100 @@ class YouTubeMp3DownloaderGUI:
         else:
             self.output_dir = os.path.dirname(os.path.abspath(__file__))
         
-        self.downloads = []
-        self.currently_downloading = False
+        self.progress_bus = ProgressBus()
+        self.job_views = {}
         self.is_dark_mode = False
         self.current_video_info = None
         
         # Load settings
         self.load_settings()
         
+        # History of converted files, also used to skip videos we already have
+        self.archive = DownloadArchive('download_archive.db')
+        self.history = HistoryStore(self.archive)
+        self.history_channel = None
+        self.history_search_job = None
+        
+        # Video info and thumbnails fetched for the preview are reused by the download
+        self.info_cache = InfoCache(os.path.join('downloader_cache', 'info'))
+        self.thumbnail_cache = thumbnail_cache(os.path.join('downloader_cache', 'thumbnails'))
+        self.thumbnail_loader = ThumbnailLoader(self.thumbnail_cache)
+        self.preview_generation = 0
+        
+        # Where each download spent its time, logged per job and optionally served for Prometheus
+        self.metrics = MetricsRecorder(self.settings['metrics_log'] or None)
+        self.metrics_server = None
+        if self.settings['metrics_port']:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, int(self.settings['metrics_port'])).start()
+            except (OSError, ValueError):
+                pass  # Port taken, run without the endpoint
+        
+        # Bandwidth and request limits shared by all downloads, backoff decisions are logged
+        self.throttle = Throttle(self.settings['bandwidth_limit_kb'] * 1024,
+                                 self.settings['requests_per_minute'],
+                                 self.settings['throttle_log'] or None)
+        self.engine = DownloadEngine(archive=self.archive, info_cache=self.info_cache, metrics=self.metrics,
+                                     thumbnail_cache=self.thumbnail_cache, throttle=self.throttle)
+        
+        # URLs waiting to be downloaded, kept across restarts and shared with the command line
+        self.queue = UrlQueue('download_archive.db')
+        self.queue_ids = []
+        self.runner = QueueRunner(self.engine, self.queue, on_update=self.on_job_update,
+                                  on_idle=self.on_queue_idle, on_item=self.on_item_finished)
+        
+        # Optional local HTTP API, other programs submit to the same queue
+        self.api_server = None
+        if self.settings['api_port']:
+            from api_server import ApiServer  # asyncio is only loaded when the API is on
+            try:
+                self.api_server = ApiServer(self.queue, self.runner, self.settings_options,
+                                            self.archive, int(self.settings['api_port'])).start()
+            except (OSError, ValueError):
+                pass  # Port taken, run without the API
+        
         # Create GUI elements
         self.create_widgets()
         
         # Apply theme
         self.apply_theme()
         
+        # Redraw download progress at a fixed rate
+        self.root.after(FRAME_INTERVAL, self.drain_progress)
+        
+        # Offer to continue downloads interrupted by a crash, exit or cancel, then start the queue
+        self.root.after(500, self.offer_resume)
+        
     def load_settings(self):
         self.settings_file = 'downloader_settings.json'
         try:
             with open(self.settings_file, 'r') as f:
                 self.settings = json.load(f)
         except:
-            self.settings = {
-                'dark_mode': False,
-                'last_directory': self.output_dir,
-                'quality': '192',
-                'auto_playlist': False
-            }
+            self.settings = {}
+        defaults = {
+            'dark_mode': False,
+            'last_directory': self.output_dir,
+            'quality': '192',
+            'auto_playlist': False,
+            'concurrency': default_concurrency(),
+            'segments': 1,
+            'chunk_size_mb': 10,
+            'tags': True,
+            'normalize': False,
+            'bandwidth_limit_kb': 0,
+            'requests_per_minute': 0,
+            'throttle_log': 'download_throttle.jsonl',
+            'metrics_log': 'download_metrics.jsonl',
+            'metrics_port': 0,
+            'api_port': 0
+        }
+        for key, value in defaults.items():
+            self.settings.setdefault(key, value)
+    
+    @property
+    def scheduler(self):
+        return self.runner.scheduler
     
     def save_settings(self):
         with open(self.settings_file, 'w') as f:
@@ -97,9 +179,8 @@ class YouTubeMp3DownloaderGUI:
         # Audio Quality Selection
         ttk.Label(options_frame, text="Audio Quality:").grid(row=0, column=0, padx=5)
         self.quality_var = tk.StringVar(value=self.settings['quality'])
-        qualities = ["64", "128", "192", "256", "320"]
         self.quality_combo = ttk.Combobox(options_frame, textvariable=self.quality_var, 
-                                        values=qualities, width=10)
+                                        values=QUALITIES, width=10)
         self.quality_combo.grid(row=0, column=1)
         ttk.Label(options_frame, text="kbps").grid(row=0, column=2)
         
@@ -117,7 +198,48 @@ class YouTubeMp3DownloaderGUI:
         ttk.Button(options_frame, text="Change Directory", 
                   command=self.change_directory).grid(row=1, column=3, padx=5)
         
-        # Download Button
+        # Parallel Downloads
+        ttk.Label(options_frame, text="Parallel Downloads:").grid(row=2, column=0, padx=5)
+        self.concurrency_var = tk.IntVar(value=self.settings['concurrency'])
+        self.concurrency_spin = ttk.Spinbox(options_frame, from_=1, to=16, width=8,
+                                          textvariable=self.concurrency_var)
+        self.concurrency_spin.grid(row=2, column=1)
+        
+        # Post-processing in the converter processes
+        post_frame = ttk.Frame(options_frame)
+        post_frame.grid(row=2, column=3, sticky='w', padx=20)
+        self.tags_var = tk.BooleanVar(value=self.settings['tags'])
+        ttk.Checkbutton(post_frame, text="Embed tags and cover art",
+                        variable=self.tags_var).pack(side=tk.LEFT)
+        self.normalize_var = tk.BooleanVar(value=self.settings['normalize'])
+        ttk.Checkbutton(post_frame, text="Normalize loudness",
+                        variable=self.normalize_var).pack(side=tk.LEFT, padx=10)
+        
+        # Segmented download of each file
+        ttk.Label(options_frame, text="Connections per File:").grid(row=3, column=0, padx=5, pady=5)
+        self.segments_var = tk.IntVar(value=self.settings['segments'])
+        ttk.Spinbox(options_frame, from_=1, to=16, width=8,
+                    textvariable=self.segments_var).grid(row=3, column=1)
+        chunk_frame = ttk.Frame(options_frame)
+        chunk_frame.grid(row=3, column=3, sticky='w', padx=20)
+        ttk.Label(chunk_frame, text="Chunk Size (MB):").pack(side=tk.LEFT)
+        self.chunk_size_var = tk.IntVar(value=self.settings['chunk_size_mb'])
+        ttk.Spinbox(chunk_frame, from_=1, to=64, width=6,
+                    textvariable=self.chunk_size_var).pack(side=tk.LEFT, padx=5)
+        
+        # Global limits, 0 means unlimited
+        ttk.Label(options_frame, text="Bandwidth (KB/s):").grid(row=4, column=0, padx=5, pady=5)
+        self.bandwidth_var = tk.IntVar(value=self.settings['bandwidth_limit_kb'])
+        ttk.Spinbox(options_frame, from_=0, to=1000000, increment=100, width=8,
+                    textvariable=self.bandwidth_var).grid(row=4, column=1)
+        rate_frame = ttk.Frame(options_frame)
+        rate_frame.grid(row=4, column=3, sticky='w', padx=20)
+        ttk.Label(rate_frame, text="Requests per Minute:").pack(side=tk.LEFT)
+        self.requests_var = tk.IntVar(value=self.settings['requests_per_minute'])
+        ttk.Spinbox(rate_frame, from_=0, to=6000, increment=10, width=6,
+                    textvariable=self.requests_var).pack(side=tk.LEFT, padx=5)
+        
+        # Download Button, adds to the queue so it works while other downloads run
         self.download_button = ttk.Button(self.main_frame, text="Download", 
                                         command=self.start_download)
         self.download_button.pack(pady=10)
@@ -141,21 +263,55 @@ class YouTubeMp3DownloaderGUI:
         self.status_label = ttk.Label(self.main_frame, text="Ready")
         self.status_label.pack(pady=5)
         
+        # Download Queue
+        queue_frame = ttk.LabelFrame(self.main_frame, text="Queue", padding="10")
+        queue_frame.pack(fill=tk.X, pady=5)
+        self.queue_list = tk.Listbox(queue_frame, width=70, height=5)
+        self.queue_list.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        queue_buttons = ttk.Frame(queue_frame)
+        queue_buttons.pack(side=tk.LEFT, padx=5)
+        for row, (text, command) in enumerate((("Move Up", lambda: self.move_queue_item(-1)),
+                                               ("Move Down", lambda: self.move_queue_item(1)),
+                                               ("Pause", self.pause_queue_item),
+                                               ("Resume", self.resume_queue_item))):
+            ttk.Button(queue_buttons, text=text, command=command, width=10).grid(row=row, column=0)
+        for row, (text, command) in enumerate((("Retry", self.retry_queue_item),
+                                               ("Remove", self.remove_queue_item))):
+            ttk.Button(queue_buttons, text=text, command=command, width=10).grid(row=row, column=1)
+        self.queue_toggle_button = ttk.Button(queue_buttons, text="Pause Queue",
+                                              command=self.toggle_queue, width=12)
+        self.queue_toggle_button.grid(row=3, column=1)
+        
         # Downloads List
         list_frame = ttk.LabelFrame(self.main_frame, text="Download History", padding="10")
         list_frame.pack(fill=tk.BOTH, expand=True)
         
-        # Scrollbar and Listbox
-        scrollbar = ttk.Scrollbar(list_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.downloads_listbox = tk.Listbox(list_frame, yscrollcommand=scrollbar.set,
-                                          width=70, height=10)
-        self.downloads_listbox.pack(fill=tk.BOTH, expand=True)
-        scrollbar.config(command=self.downloads_listbox.yview)
+        # Search and filters
+        filter_frame = ttk.Frame(list_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(filter_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', lambda *args: self.schedule_history_search())
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=30).pack(side=tk.LEFT, padx=5)
+        self.period_var = tk.StringVar(value='All time')
+        period_combo = ttk.Combobox(filter_frame, textvariable=self.period_var, state='readonly',
+                                    values=list(HISTORY_PERIODS), width=12)
+        period_combo.pack(side=tk.LEFT, padx=5)
+        period_combo.bind('<<ComboboxSelected>>', lambda e: self.apply_history_filters())
+        self.channel_filter_label = ttk.Label(filter_frame, text="")
+        self.channel_filter_label.pack(side=tk.LEFT, padx=5)
+        ttk.Button(filter_frame, text="Clear", command=self.clear_history_filters).pack(side=tk.RIGHT)
+        
+        # Only the rows on screen are in the Listbox, the rest stay in the archive
+        rows_frame = ttk.Frame(list_frame)
+        rows_frame.pack(fill=tk.BOTH, expand=True)
+        self.history_view = HistoryView(rows_frame, self.history, self.format_history,
+                                        width=70, height=10)
         
         # Right-click menu for downloads list
         self.create_context_menu()
+        
+        self.history_view.refresh()
     
     def create_menu(self):
         menubar = tk.Menu(self.root)
@@ -173,6 +329,7 @@ class YouTubeMp3DownloaderGUI:
         options_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Options", menu=options_menu)
         options_menu.add_checkbutton(label="Dark Mode", command=self.toggle_dark_mode)
+        options_menu.add_command(label="Download Statistics", command=self.show_statistics)
         
         # Help Menu
         help_menu = tk.Menu(menubar, tearoff=0)
@@ -185,15 +342,15 @@ class YouTubeMp3DownloaderGUI:
         self.context_menu.add_command(label="Open File Location", command=self.open_file_location)
         self.context_menu.add_command(label="Copy File Path", command=self.copy_file_path)
         self.context_menu.add_command(label="Remove from List", command=self.remove_from_list)
+        self.context_menu.add_command(label="Show Only This Channel", command=self.filter_by_channel)
         
-        self.downloads_listbox.bind("<Button-3>", self.show_context_menu)
+        self.history_view.bind("<Button-3>", self.show_context_menu)
     
     def show_context_menu(self, event):
         try:
-            index = self.downloads_listbox.nearest(event.y)
+            index = self.history_view.nearest(event.y)
             if index >= 0:
-                self.downloads_listbox.selection_clear(0, tk.END)
-                self.downloads_listbox.selection_set(index)
+                self.history_view.select_row(index)
                 self.context_menu.tk_popup(event.x_root, event.y_root)
         finally:
             self.context_menu.grab_release()
@@ -204,20 +361,18 @@ class YouTubeMp3DownloaderGUI:
             messagebox.showerror("Error", "Please enter a YouTube URL")
             return
         
+        options = {
+            'playlist': self.playlist_var.get(),
+            'output_dir': self.output_dir,
+        }
+        
         def fetch_info():
             try:
-                ydl_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'extract_flat': True
-                }
+                info = self.engine.extract_info(url, options)
+                self.current_video_info = info
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    self.current_video_info = info
-                    
-                    # Update GUI in main thread
-                    self.root.after(0, lambda: self.update_preview(info))
+                # Update GUI in main thread
+                self.root.after(0, lambda: self.update_preview(info))
             
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", f"Could not fetch video info: {str(e)}"))
@@ -232,6 +387,7 @@ class YouTubeMp3DownloaderGUI:
         # Update duration
         duration = info.get('duration')
         if duration:
+            duration = int(duration)
             minutes = duration // 60
             seconds = duration % 60
             self.duration_label.config(text=f"Duration: {minutes}:{seconds:02d}")
@@ -239,19 +395,28 @@ class YouTubeMp3DownloaderGUI:
         # Update channel
         self.channel_label.config(text=f"Channel: {info.get('uploader', 'N/A')}")
         
-        # Update thumbnail
-        try:
-            thumbnail_url = info.get('thumbnail')
-            if thumbnail_url:
-                with urlopen(thumbnail_url) as u:
-                    raw_data = u.read()
-                image = Image.open(BytesIO(raw_data))
-                image = image.resize((120, 68), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(image)
-                self.thumbnail_label.config(image=photo)
-                self.thumbnail_label.image = photo
-        except:
-            self.thumbnail_label.config(text="No thumbnail")
+        # Update thumbnail, fetched and resized off the main thread
+        self.preview_generation += 1
+        generation = self.preview_generation
+        thumbnail_url = info.get('thumbnail')
+        if thumbnail_url:
+            self.thumbnail_loader.request(
+                thumbnail_url,
+                lambda image: self.root.after(0, lambda: self.show_thumbnail(image, generation)))
+        else:
+            self.show_thumbnail(None, generation)
+    
+    def show_thumbnail(self, image, generation):
+        if generation != self.preview_generation:
+            return  # A newer preview was requested meanwhile
+        if image is None:
+            self.thumbnail_label.config(image='', text="No thumbnail")
+            self.thumbnail_label.image = None
+            return
+        from PIL import ImageTk  # Loaded with the first thumbnail rather than at startup
+        photo = ImageTk.PhotoImage(image)
+        self.thumbnail_label.config(image=photo, text='')
+        self.thumbnail_label.image = photo
     
     def toggle_dark_mode(self):
         self.is_dark_mode = not self.is_dark_mode
@@ -269,7 +434,8 @@ class YouTubeMp3DownloaderGUI:
             style.configure("TFrame", background='#2d2d2d')
             style.configure("TLabelframe", background='#2d2d2d', foreground='white')
             style.configure("TLabelframe.Label", background='#2d2d2d', foreground='white')
-            self.downloads_listbox.configure(bg='#3d3d3d', fg='white')
+            self.history_view.configure(bg='#3d3d3d', fg='white')
+            self.queue_list.configure(bg='#3d3d3d', fg='white')
         else:
             self.root.configure(bg='#f0f0f0')
             style.configure(".", background='#f0f0f0', foreground='black')
@@ -277,7 +443,8 @@ class YouTubeMp3DownloaderGUI:
             style.configure("TFrame", background='#f0f0f0')
             style.configure("TLabelframe", background='#f0f0f0', foreground='black')
             style.configure("TLabelframe.Label", background='#f0f0f0', foreground='black')
-            self.downloads_listbox.configure(bg='white', fg='black')
+            self.history_view.configure(bg='white', fg='black')
+            self.queue_list.configure(bg='white', fg='black')
     
     def change_directory(self):
         new_dir = filedialog.askdirectory(initialdir=self.output_dir)
@@ -288,123 +455,328 @@ class YouTubeMp3DownloaderGUI:
             self.save_settings()
     
     def start_download(self):
-        if self.currently_downloading:
-            return
-            
         url = self.url_entry.get().strip()
         if not url:
             messagebox.showerror("Error", "Please enter a YouTube URL")
             return
         
-        self.currently_downloading = True
-        self.download_button.config(state='disabled')
-        self.cancel_button.config(state='normal')
-        self.status_label.config(text="Starting download...")
-        self.progress_var.set(0)
+        title = None
+        if self.current_video_info and url in (self.current_video_info.get('webpage_url'),
+                                               self.current_video_info.get('original_url')):
+            title = self.current_video_info.get('title')
+        self.queue.add(url, self.download_options(), title=title)
+        self.url_entry.delete(0, tk.END)
+        self.refresh_queue()
+        self.runner.wake()
+    
+    def offer_resume(self):
+        # Downloads from versions without the queue are moved into it first
+        state_store = JobStateStore('download_archive.db')
+        import_unfinished(self.queue, state_store)
+        state_store.close()
+        waiting = [item for item in self.queue.items() if item['state'] == UrlQueue.PENDING]
+        if waiting and not messagebox.askyesno(
+                "Resume Downloads",
+                f"{len(waiting)} download(s) did not finish last time. Resume them?"):
+            # Kept in the queue, paused, so they can still be resumed one by one
+            self.queue.pause_all()
+        self.refresh_queue()
+        self.runner.start()
+        self.root.after(QUEUE_POLL_INTERVAL, self.poll_queue)
+    
+    def download_options(self):
+        try:
+            concurrency = max(1, int(self.concurrency_var.get()))
+        except (tk.TclError, ValueError):
+            concurrency = default_concurrency()
+        try:
+            segments = max(1, int(self.segments_var.get()))
+            chunk_size_mb = max(1, int(self.chunk_size_var.get()))
+        except (tk.TclError, ValueError):
+            segments, chunk_size_mb = 1, 10
+        try:
+            bandwidth_kb = max(0, int(self.bandwidth_var.get()))
+            requests_per_minute = max(0, int(self.requests_var.get()))
+        except (tk.TclError, ValueError):
+            bandwidth_kb, requests_per_minute = 0, 0
+        # Limits apply to everything from now on, downloads already running included
+        self.throttle.configure(bandwidth_kb * 1024, requests_per_minute)
+        self.settings['bandwidth_limit_kb'] = bandwidth_kb
+        self.settings['requests_per_minute'] = requests_per_minute
+        self.settings['concurrency'] = concurrency
+        self.settings['segments'] = segments
+        self.settings['chunk_size_mb'] = chunk_size_mb
+        self.settings['quality'] = self.quality_var.get()
+        self.settings['auto_playlist'] = self.playlist_var.get()
+        self.settings['tags'] = self.tags_var.get()
+        self.settings['normalize'] = self.normalize_var.get()
+        self.save_settings()
         
-        # Start download in separate thread
-        self.download_thread = threading.Thread(target=self.download_thread_func, args=(url,))
-        self.download_thread.daemon = True
-        self.download_thread.start()
+        # Read the Tk variables here, workers must not touch them
+        return self.settings_options()
+    
+    def settings_options(self):
+        # From the saved settings only, so the API thread can call it too
+        return {
+            'quality': self.settings['quality'],
+            'playlist': self.settings['auto_playlist'],
+            'output_dir': self.output_dir,
+            'concurrency': self.settings['concurrency'],
+            'segments': self.settings['segments'],
+            'chunk_size': self.settings['chunk_size_mb'] * 1024 * 1024,
+            'tags': self.settings['tags'],
+            'normalize': self.settings['normalize'],
+        }
     
     def cancel_download(self):
-        if hasattr(self, 'current_process'):
-            self.current_process.terminate()
-        self.status_label.config(text="Download cancelled")
-        self.currently_downloading = False
-        self.download_button.config(state='normal')
+        # Stops transfers in flight too and pauses the queue, their .part files are resumed later
+        self.runner.cancel()
+        self.queue_toggle_button.config(text="Resume Queue")
+        self.status_label.config(text="Cancelling...")
         self.cancel_button.config(state='disabled')
     
-    def download_thread_func(self, url):
+    def on_queue_idle(self, scheduler):
+        # Never touches Tk, runs on the queue thread once everything queued has finished
+        counts = scheduler.counts()
+        if scheduler.cancelled:
+            status = "Download cancelled"
+        elif counts[DownloadJob.FAILED]:
+            status = (f"Completed {counts[DownloadJob.DONE]}, "
+                      f"failed {counts[DownloadJob.FAILED]}")
+        else:
+            status = "Download Complete!"
+        self.progress_bus.post('batch', finished=True, status=status)
+    
+    def poll_queue(self):
         try:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': os.path.join(self.output_dir, '%(title)s.%(ext)s'),
-                'progress_hooks': [self.update_progress],
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',           
-                    'preferredcodec': 'mp3',
-                    'preferredquality': self.quality_var.get(),
-                }],
-                'ignoreerrors': True,
-                'noplaylist': not self.playlist_var.get(),
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if info.get('_type') == 'playlist' and self.playlist_var.get():
-                    total_videos = len(info['entries'])
-                    for index, entry in enumerate(info['entries'], 1):
-                        if not self.currently_downloading:  # Check if cancelled
-                            break
-                        self.root.after(0, lambda: self.status_label.config(
-                            text=f"Downloading video {index}/{total_videos}"))
-                        ydl.download([entry['webpage_url']])
-                else:
-                    ydl.download([url])
-                
-                # Add to downloads list
-                title = info.get('title', 'Unknown Title')
-                download_info = f"{datetime.now().strftime('%Y-%m-%d %H:%M')} - {title}"
-                self.downloads.append({
-                    'time': datetime.now().strftime('%Y-%m-%d %H:%M'),
-                    'title': title,
-                    'path': os.path.join(self.output_dir, f"{title}.mp3")
-                })
-                self.root.after(0, lambda: self.downloads_listbox.insert(0, download_info))
-            
-            self.root.after(0, lambda: self.status_label.config(text="Download Complete!"))
-            
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Download failed: {str(e)}"))
-            self.root.after(0, lambda: self.status_label.config(text="Download Failed"))
-        
+            for url in read_drop_file(DROP_FILE):
+                self.queue.add(url, self.download_options())
+            if self.queue.changed():
+                self.refresh_queue()
+                self.runner.wake()
         finally:
-            self.currently_downloading = False
-            self.root.after(0, lambda: self.download_button.config(state='normal'))
-            self.root.after(0, lambda: self.cancel_button.config(state='disabled'))
-            self.root.after(0, lambda: self.progress_var.set(0))
+            self.root.after(QUEUE_POLL_INTERVAL, self.poll_queue)
     
-    def update_progress(self, d):
-        if d['status'] == 'downloading':
-            try:
-                progress = float(d['_percent_str'].replace('%', ''))
-                self.progress_var.set(progress)
-                self.status_label.config(
-                    text=f"Downloading: {progress:.1f}% (Speed: {d.get('_speed_str', 'N/A')})")
-            except:
-                pass
-        elif d['status'] == 'finished':
-            self.status_label.config(text="Converting to MP3...")
-            self.progress_var.set(100)
+    def refresh_queue(self):
+        selected = self.selected_queue_item()
+        items = self.queue.items()
+        self.queue_ids = [item['id'] for item in items]
+        self.queue_list.delete(0, tk.END)
+        now = time.time()
+        for item in items:
+            state = item['state']
+            if state == UrlQueue.PENDING and item['next_attempt_at'] > now:
+                state = f"retry in {int(item['next_attempt_at'] - now) + 1}s"
+            text = f"[{state}] {item['title'] or item['url']}"
+            if item['error']:
+                text += f" - {item['error']}"
+            self.queue_list.insert(tk.END, text)
+        if selected in self.queue_ids:
+            self.queue_list.selection_set(self.queue_ids.index(selected))
+    
+    def selected_queue_item(self):
+        selection = self.queue_list.curselection()
+        if not selection or selection[0] >= len(self.queue_ids):
+            return None
+        return self.queue_ids[selection[0]]
+    
+    def move_queue_item(self, offset):
+        item_id = self.selected_queue_item()
+        if item_id is not None and self.queue.move(item_id, offset):
+            self.refresh_queue()
+    
+    def pause_queue_item(self):
+        item_id = self.selected_queue_item()
+        if item_id is not None:
+            self.runner.pause_item(item_id)
+            self.refresh_queue()
+    
+    def resume_queue_item(self):
+        item_id = self.selected_queue_item()
+        if item_id is not None:
+            self.queue.resume(item_id)
+            self.refresh_queue()
+            self.runner.wake()
+    
+    def retry_queue_item(self):
+        item_id = self.selected_queue_item()
+        if item_id is not None:
+            self.queue.retry(item_id)
+            self.refresh_queue()
+            self.runner.wake()
+    
+    def remove_queue_item(self):
+        item_id = self.selected_queue_item()
+        if item_id is not None:
+            self.runner.remove_item(item_id)
+            self.refresh_queue()
+    
+    def toggle_queue(self):
+        if self.runner.paused:
+            self.runner.resume()
+            self.queue_toggle_button.config(text="Pause Queue")
+        else:
+            self.runner.pause()
+            self.queue_toggle_button.config(text="Resume Queue")
+    
+    def format_history(self, record):
+        return f"{record.downloaded_at[:16]} - {record.title}"
+    
+    def schedule_history_search(self):
+        # Wait for a pause in typing instead of querying on every key
+        if self.history_search_job is not None:
+            self.root.after_cancel(self.history_search_job)
+        self.history_search_job = self.root.after(250, self.apply_history_filters)
+    
+    def apply_history_filters(self):
+        self.history_search_job = None
+        days = HISTORY_PERIODS.get(self.period_var.get())
+        since = None
+        if days is not None:
+            start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            since = (start - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        self.history.set_filters(self.search_var.get().strip(), self.history_channel, since)
+        self.channel_filter_label.config(
+            text=f"Channel: {self.history_channel}" if self.history_channel is not None else "")
+        self.history_view.offset = 0
+        self.history_view.refresh()
+    
+    def filter_by_channel(self):
+        record = self.history_view.selected()
+        if record:
+            self.history_channel = record.channel
+            self.apply_history_filters()
+    
+    def clear_history_filters(self):
+        self.history_channel = None
+        self.period_var.set('All time')
+        self.search_var.set('')
+        self.apply_history_filters()
+    
+    def on_job_update(self, job):
+        # Called from worker threads, only queue the change for the next frame
+        self.progress_bus.post(job.id, **job_fields(job))
+        if self.api_server is not None:
+            self.api_server.job_changed(job)
+    
+    def on_item_finished(self, item_id, outcome, jobs):
+        # Never touches Tk, the queue list refreshes from poll_queue
+        if self.api_server is not None:
+            self.api_server.item_finished(item_id, outcome, jobs)
+    
+    def drain_progress(self):
+        try:
+            updates = self.progress_bus.drain()
+            batch = updates.pop('batch', None)
+            finished = False
+            for job_id, fields in updates.items():
+                view = self.job_views.setdefault(job_id, {})
+                finished_before = view.get('state') == DownloadJob.DONE
+                view.update(fields)
+                finished = finished or (view['state'] == DownloadJob.DONE and not finished_before)
+            if finished:
+                # The engine has already added them to the archive, reload the rows on screen
+                self.history_view.refresh(invalidate=True)
+            if updates:
+                self.cancel_button.config(state='normal')
+                self.refresh_download_status()
+            if batch:
+                self.finish_batch(batch)
+        finally:
+            self.root.after(FRAME_INTERVAL, self.drain_progress)
+    
+    def finish_batch(self, batch):
+        self.status_label.config(text=batch['status'])
+        self.cancel_button.config(state='disabled')
+        self.progress_var.set(0)
+        # Job ids start over with the next scheduler
+        self.job_views = {job_id: view for job_id, view in self.job_views.items()
+                          if view['state'] not in DownloadJob.FINISHED_STATES}
+        if batch.get('error'):
+            messagebox.showerror("Error", batch['error'])
+    
+    def refresh_download_status(self):
+        scheduler = self.scheduler
+        if scheduler is None or scheduler.cancelled:
+            return
+        views = list(self.job_views.values())
+        total = max(len(views), scheduler.expected_total or 0)
+        if not total:
+            return
+        counts = {}
+        for view in views:
+            counts[view['state']] = counts.get(view['state'], 0) + 1
+        finished = sum(counts.get(state, 0) for state in DownloadJob.FINISHED_STATES)
+        self.progress_var.set(sum(100.0 if view['state'] in DownloadJob.FINISHED_STATES
+                                  else view['progress'] for view in views) / total)
+        if finished == total and not scheduler.listing:
+            return
+        
+        running = [view for view in views if view['state'] == DownloadJob.RUNNING]
+        processing = counts.get(DownloadJob.PROCESSING, 0)
+        failed = counts.get(DownloadJob.FAILED, 0)
+        if scheduler.listing:
+            total = f"{total}+"  # Playlist still being listed
+        if total == 1 and running:
+            view = running[0]
+            text = f"{view['status_text']}: {view['progress']:.1f}% (Speed: {format_speed(view['speed'])})"
+            if view['eta'] is not None:
+                text += f" ETA {int(view['eta']) // 60}:{int(view['eta']) % 60:02d}"
+        elif total == 1 and processing:
+            text = "Converting to MP3..."
+        else:
+            text = (f"Downloading video {finished}/{total} ({len(running)} active, "
+                    f"{processing} converting)")
+            if failed:
+                text += f", {failed} failed"
+        self.status_label.config(text=text)
     
     def clear_history(self):
         if messagebox.askyesno("Clear History", "Are you sure you want to clear the download history?"):
-            self.downloads_listbox.delete(0, tk.END)
-            self.downloads = []
+            self.archive.clear()
+            self.history_view.refresh(invalidate=True)
     
     def open_file_location(self):
-        selection = self.downloads_listbox.curselection()
-        if selection:
-            index = selection[0]
-            file_path = self.downloads[index]['path']
-            folder_path = os.path.dirname(file_path)
+        record = self.history_view.selected()
+        if record:
+            folder_path = os.path.dirname(record.path)
             os.startfile(folder_path)
     
     def copy_file_path(self):
-        selection = self.downloads_listbox.curselection()
-        if selection:
-            index = selection[0]
-            file_path = self.downloads[index]['path']
+        record = self.history_view.selected()
+        if record:
             self.root.clipboard_clear()
-            self.root.clipboard_append(file_path)
+            self.root.clipboard_append(record.path)
     
     def remove_from_list(self):
-        selection = self.downloads_listbox.curselection()
-        if selection:
-            index = selection[0]
-            self.downloads_listbox.delete(index)
-            self.downloads.pop(index)
+        record = self.history_view.selected()
+        if record:
+            self.archive.remove(record.video_id, record.quality)
+            self.history_view.refresh(invalidate=True)
+    
+    def show_statistics(self):
+        summary = self.metrics.summary()
+        if not summary['jobs']:
+            messagebox.showinfo("Download Statistics", "Nothing downloaded in this session yet.")
+            return
+        lines = [f"{state.capitalize()}: {count}" for state, count in summary['jobs'].items()]
+        lines.append("")
+        for stage in STAGES:
+            stats = summary['stages'][stage]
+            if stats['count']:
+                lines.append(f"{stage}: {stats['total_s']:.1f}s total, {stats['avg_s']:.2f}s per video")
+        lines.append("")
+        lines.append(f"Downloaded: {format_bytes(summary['bytes'])} "
+                     f"at {format_speed(summary['throughput'])}")
+        lines.append(f"Retries: {summary['retries']}")
+        if summary['bytes_saved'] or summary['transcode_avoided_s']:
+            lines.append(f"Saved by picking smaller formats: {format_bytes(summary['bytes_saved'])}, "
+                         f"about {summary['transcode_avoided_s']:.1f}s of encoding")
+        if summary['errors']:
+            lines.append("Errors: " + ", ".join(f"{stage} {count}" for stage, count in summary['errors'].items()))
+        if summary['bottleneck']:
+            lines.append(f"Most time spent in: {summary['bottleneck']}")
+        messagebox.showinfo("Download Statistics", "\n".join(lines))
     
     def show_about(self):
         about_text = """YouTube MP3 Downloader
@@ -437,17 +809,46 @@ Credit to its solely creator: @GitHub Yujinhmnida
 6. Click 'Download' to start
 
 Tips:
+- Paste more URLs and click 'Download' while others run, they wait in the Queue
+- URLs appended to download_queue.txt are added to the Queue too
 - Right-click downloads to see more options
+- Type in the Search box to find past downloads by title or channel
 - Use dark mode for night viewing
 - You can cancel downloads in progress
 - Preview helps verify correct video"""
         
         messagebox.showinfo("Instructions", instructions_text)
 
+def format_speed(speed):
+    return f"{format_bytes(speed)}/s" if speed else 'N/A'
+
+def report_first_paint(root, path):
+    # For benchmarks/bench_startup.py: write the time the window was first drawn, then close
+    def painted(event):
+        if event.widget is not root:
+            return
+        root.unbind('<Map>')
+        root.update_idletasks()
+        with open(path, 'w') as f:
+            json.dump({'first_paint': time.time(),
+                       'loaded': [name for name in ('yt_dlp', 'PIL') if name in sys.modules]}, f)
+        root.after(0, root.quit)
+    root.bind('<Map>', painted)
+
 def main():
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = YouTubeMp3DownloaderGUI(root)
+    if '--measure-startup' in sys.argv:
+        report_first_paint(root, sys.argv[sys.argv.index('--measure-startup') + 1])
     root.mainloop()
+    app.runner.stop()  # Unfinished items stay queued for the next start
+    app.engine.shutdown(wait=False)
+    app.thumbnail_loader.shutdown()
+    if app.metrics_server:
+        app.metrics_server.stop()
+    if app.api_server:
+        app.api_server.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from download_scheduler import DownloadJob
+from download_engine import DownloadEngine, QUALITIES, default_options
+from download_archive import DownloadArchive
+from info_cache import InfoCache, thumbnail_cache
+from job_state import JobStateStore
+from metrics import MetricsRecorder, MetricsServer
+from url_queue import UrlQueue, import_unfinished
+from queue_runner import QueueRunner, process_owner
+from throttle import Throttle
+
+
+class JsonProgressWriter:
+    # One JSON object per line on stdout, progress only when it moved a whole percent
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def reset(self):
+        # Job ids start over with each scheduler
+        with self._lock:
+            self._last.clear()
+
+    def on_job_update(self, job):
+        key = (job.state, int(job.progress), job.status_text)
+        with self._lock:
+            if self._last.get(job.id) == key:
+                return
+            self._last[job.id] = key
+        self.emit('job', id=job.id, url=job.url, title=job.title, state=job.state,
+                  status=job.status_text, progress=round(job.progress, 1),
+                  downloaded_bytes=job.downloaded_bytes, total_bytes=job.total_bytes,
+                  speed=round(job.speed) if job.speed else None, eta=job.eta, error=job.error,
+                  path=job.result if job.state in (DownloadJob.DONE, DownloadJob.SKIPPED) else None,
+                  bytes_saved=job.bytes_saved, transcode_avoided=round(job.transcode_avoided, 3))
+
+
+def read_urls(args):
+    urls = list(args.urls)
+    if args.file:
+        if args.file == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        urls.extend(lines)
+    elif not urls and not args.resume and not sys.stdin.isatty():
+        urls.extend(sys.stdin.read().splitlines())
+    # Blank lines and '#' comments are allowed in URL files
+    return [url.strip() for url in urls if url.strip() and not url.strip().startswith('#')]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert YouTube videos to MP3 without the GUI. "
+                    "Progress is written to stdout as JSON lines.")
+    parser.add_argument('urls', nargs='*', help="YouTube video or playlist URLs")
+    parser.add_argument('-f', '--file', help="read URLs from a file, one per line ('-' for stdin)")
+    parser.add_argument('-q', '--quality', choices=QUALITIES, default='192', help="MP3 bitrate in kbps")
+    parser.add_argument('-o', '--output-dir', default=os.getcwd(), help="where to save the MP3 files")
+    parser.add_argument('-j', '--concurrency', type=int, default=None,
+                        help="number of parallel downloads (default: based on CPU count)")
+    parser.add_argument('--segments', type=int, default=1,
+                        help="fetch each file over N parallel range requests (default: 1)")
+    parser.add_argument('--chunk-size', type=int, default=10, metavar='MB',
+                        help="size of each range request with --segments (default: 10)")
+    parser.add_argument('--playlist', action='store_true', help="download entire playlists")
+    parser.add_argument('--no-tags', action='store_true',
+                        help="don't write ID3 tags and cover art into the MP3 files")
+    parser.add_argument('--normalize', action='store_true',
+                        help="normalize loudness to -16 LUFS (two-pass loudnorm, takes an extra ffmpeg pass)")
+    parser.add_argument('--archive', default='download_archive.db',
+                        help="SQLite file of finished downloads, already converted videos are skipped")
+    parser.add_argument('--no-archive', action='store_true', help="convert everything again")
+    parser.add_argument('--resume', action='store_true',
+                        help="also run everything else waiting in the queue, e.g. left unfinished by an earlier run")
+    parser.add_argument('--enqueue', action='store_true',
+                        help="only add the URLs to the queue (a running GUI picks them up) and exit")
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help="keep running and take URLs over HTTP on 127.0.0.1:PORT until Ctrl+C")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="attempts per URL before it is marked failed in the queue (default: 3)")
+    parser.add_argument('--limit-rate', type=int, default=0, metavar='KB/S',
+                        help="total download bandwidth of all workers together (default: unlimited)")
+    parser.add_argument('--requests-per-minute', type=int, default=0, metavar='N',
+                        help="total HTTP requests per minute, listing and downloads (default: unlimited)")
+    parser.add_argument('--throttle-log',
+                        help="also append backoff and concurrency decisions to this file as JSON lines")
+    parser.add_argument('--cache-dir', default=os.path.join('downloader_cache', 'info'),
+                        help="where extracted video info is cached between runs")
+    parser.add_argument('--no-cache', action='store_true', help="always fetch fresh video info")
+    parser.add_argument('--metrics-log', help="append per-job stage timings to this file as JSON lines")
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    urls = read_urls(args)
+    if not urls and not args.resume and not args.serve:
+        print("No URLs given", file=sys.stderr)
+        return 2
+
+    options = default_options(os.path.abspath(args.output_dir))
+    options['quality'] = args.quality
+    options['playlist'] = args.playlist
+    if args.concurrency:
+        options['concurrency'] = max(1, args.concurrency)
+    options['segments'] = max(1, args.segments)
+    options['chunk_size'] = max(1, args.chunk_size) * 1024 * 1024
+    options['tags'] = not args.no_tags
+    options['normalize'] = args.normalize
+    os.makedirs(options['output_dir'], exist_ok=True)
+
+    writer = JsonProgressWriter()
+    archive = None if args.no_archive else DownloadArchive(args.archive)
+    info_cache = None if args.no_cache else InfoCache(args.cache_dir)
+    thumbnails = None if args.no_cache else thumbnail_cache(
+        os.path.join(os.path.dirname(args.cache_dir), 'thumbnails'))
+    # The queue lives next to the archive so --resume can find it. URLs given here are
+    # run by this process, a GUI on the same queue only gets them with --enqueue
+    queue = UrlQueue(args.archive)
+    owner = process_owner('cli')
+    item_ids = [queue.add(url, options, reserved=None if args.enqueue else owner) for url in urls]
+    for item_id, url in zip(item_ids, urls):
+        writer.emit('queued', item=item_id, url=url)
+    if args.enqueue:
+        return 0
+    if args.resume:
+        # Jobs left by versions without the queue
+        state_store = JobStateStore(args.archive)
+        import_unfinished(queue, state_store)
+        state_store.close()
+    metrics = MetricsRecorder(args.metrics_log)
+    server = MetricsServer(metrics, args.metrics_port).start() if args.metrics_port else None
+    # Backoff and concurrency decisions show up as 'throttle' events between the job updates
+    throttle = Throttle(max(0, args.limit_rate) * 1024, max(0, args.requests_per_minute),
+                        args.throttle_log, on_event=lambda event, fields: writer.emit(
+                            'throttle', decision=event, **fields))
+    engine = DownloadEngine(archive=archive, info_cache=info_cache, metrics=metrics,
+                            thumbnail_cache=thumbnails, throttle=throttle)
+    # Jobs of all schedulers the runner went through, retries included
+    counts = {}
+
+    def add_counts(scheduler):
+        writer.reset()
+        for state, count in scheduler.counts().items():
+            counts[state] = counts.get(state, 0) + count
+
+    api = None
+
+    def job_changed(job):
+        writer.on_job_update(job)
+        if api is not None:
+            api.job_changed(job)
+
+    def item_finished(item_id, outcome, jobs):
+        if api is not None:
+            api.item_finished(item_id, outcome, jobs)
+
+    # Failed URLs are retried with backoff until they succeed or run out of attempts.
+    # A server runs everything queued and keeps yt-dlp, the converters and connections warm
+    runner = QueueRunner(engine, queue, on_update=job_changed, on_idle=add_counts,
+                         only=None if args.resume or args.serve else item_ids,
+                         max_attempts=max(1, args.retries), exit_when_idle=not args.serve,
+                         on_item=item_finished, owner=owner)
+    if args.serve:
+        from api_server import ApiServer
+        try:
+            api = ApiServer(queue, runner, lambda: dict(options), archive, args.serve).start()
+        except OSError as e:
+            print(f"Cannot serve on port {args.serve}: {e}", file=sys.stderr)
+            return 2
+        writer.emit('serving', url=f"http://127.0.0.1:{api.port}")
+    started = time.time()
+    try:
+        runner.start()
+        runner.join()
+    except KeyboardInterrupt:
+        writer.emit('cancelled')
+        runner.stop()
+        engine.shutdown(wait=False)
+        return 130
+    finally:
+        if server is not None:
+            server.stop()
+        if api is not None:
+            api.stop()
+    engine.shutdown()
+
+    writer.emit('summary', elapsed=round(time.time() - started, 3), metrics=metrics.summary(),
+                failed_urls=[item['url'] for item in map(queue.get, runner.failed) if item],
+                **counts)
+    return 1 if runner.failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())